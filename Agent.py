@@ -2,13 +2,19 @@ import math
 from PIL import Image
 
 from Base import Base
+from ClassificationEngine import ClassificationEngine
 from Disjunction import Disjunction
 from Intersection import Intersection
 from PixelAddition import PixelAddition
 from PixelSubtraction import PixelSubtraction
 from Union import Union
 
-from ImageUtils import ImageUtils
+from FigureStore import FigureStore
+from InMemoryProblem import InMemoryFigure
+from MaskCache import MaskCache
+from ProblemBatch import ProblemBatch
+from SolveResult import SolveResult
+from SolveTimings import clock
 from Transform import Transform
 from Unchanged import Unchanged
 
@@ -18,9 +24,56 @@ class Agent:
     PROBLEM_CLASSES = [Unchanged, Union, Intersection, Disjunction,
                        PixelSubtraction, PixelAddition]
 
-    def __init__(self):
-        self.problem = None
-        self.problem_figures = {}
+    # Values of solved_by besides the names of PROBLEM_CLASSES.
+    SOLVED_BY_SKIP = 'Skip'
+    SOLVED_BY_TRANSFORM = 'Transform'
+
+    DEFAULT_BATCH_SIZE = 16
+
+    def __init__(self, mask_cache=None, packed=False, timings_hook=None,
+                 profiler=None, batch_size=DEFAULT_BATCH_SIZE,
+                 prune=False, coarse_to_fine=False, align=False,
+                 bundle=None):
+        """
+        Args:
+            mask_cache (MaskCache): Cache of decoded figure masks. Defaults to
+                the cache configured by the environment (see
+                MaskCache.from_environment); pass False to bypass caching.
+            packed (bool): Classify and solve on bit-packed masks
+                (PackedMask) instead of np.int_ arrays.
+            timings_hook (callable): Called with the SolveTimings of every
+                solved problem, e.g. a SolveTimingsWriter.
+            profiler (ProblemProfiler): Profiles the Solve calls it selects.
+            batch_size (int): Most problems solve_batch stacks together.
+            prune (bool): Skip the full comparisons that the figures'
+                summaries show cannot meet the match thresholds. The answers
+                are the same either way.
+            coarse_to_fine (bool): Prune on the figures' Pyramids too, coarse
+                to fine.
+            align (bool): Compare pairs of figures at the offset of up to
+                Alignment.MAX_SHIFT pixels where they match best, so that
+                figures that are only shifted still match. Unlike the other
+                options this can change the answers.
+            bundle (ProblemBundle): Read figure masks and images from this
+                bundle rather than the PNG files (and the mask cache).
+        """
+
+        # The outcome of the last Solve call (see SolveResult). solve_batch
+        # does not set them.
+        self.solved_by = None
+        self.classification_scores = None
+        self.timings = None
+        self.timings_hook = timings_hook
+        self.profiler = profiler
+        if mask_cache is None:
+            mask_cache = MaskCache.from_environment()
+        self.mask_cache = mask_cache or None
+        self.packed = packed
+        self.batch_size = batch_size
+        self.prune = prune or coarse_to_fine
+        self.coarse_to_fine = coarse_to_fine
+        self.align = align
+        self.bundle = bundle
 
     @staticmethod
     def generate_problem_images(problem):
@@ -37,57 +90,214 @@ class Agent:
                     in the form of:
                         {
                             'image':  # The figure image as a PIL image.
-                            'pixels':  # A list of pixels in the image.
                         }
         """
 
         problem_figures = {}
         solution_figures = {}
         for figure in problem.figures.itervalues():
-            figure_image = Image.open(figure.visualFilename)
-            image_pixels = list(figure_image.getdata())
-            image_details = dict(image=figure_image, pixels=image_pixels)
+            if isinstance(figure, InMemoryFigure):
+                figure_image = figure.open_image()
+            else:
+                figure_image = Image.open(figure.visualFilename)
+            image_details = dict(image=figure_image)
             if figure.name in Base.PROBLEM_FIGURE_KEYS:
                 problem_figures[figure.name] = image_details
             elif figure.name in Base.SOLUTION_FIGURE_KEYS:
                 solution_figures[figure.name] = image_details
         return problem_figures, solution_figures
 
-    def Solve(self, problem):
-        self.problem = problem
+    @staticmethod
+    def is_skipped(problem):
+        """Whether Solve skips the problem without looking at its figures."""
+
+        return problem.problemSetName.split(' ')[-1] not in Agent.PROBLEM_SETS
 
-        if self.problem.problemSetName.split(' ')[-1] not in Agent.PROBLEM_SETS:
-            return Base.SKIP
+    def create_figure_store(self, problem):
+        """Creates the FigureStore Solve would use for the problem."""
 
-        self.__get_problem_data()
-        problem_class = self.__classify_problem()
+        return FigureStore(problem, self.mask_cache, self.packed,
+                           self.coarse_to_fine, self.bundle)
 
-        if problem_class is None:
-            return self.transformation_match_percentage_strategy()
+    def Solve(self, problem, figure_store=None):
+        """Solves a problem. A batch of one for solve_batch_results; the
+        outcome is also kept in solved_by, timings and
+        classification_scores.
 
-        problem_solver = problem_class(self.problem_figures)
+        Args:
+            problem (RavensProblem): The problem to solve.
+            figure_store (FigureStore): The problem's figures, possibly
+                decoded ahead of time (see create_figure_store). Created here
+                if not given. Released before returning either way.
+
+        Return:
+            (int): The answer, or Base.SKIP.
+        """
+
+        if self.profiler is not None:
+            result = self.profiler.run(problem, self.__solve_one, problem,
+                                       figure_store)
+        else:
+            result = self.__solve_one(problem, figure_store)
+        self.solved_by = result.solved_by
+        self.timings = result.timings
+        self.classification_scores = result.classification_scores
+        return result.answer
 
-        return problem_solver.solve()
+    def __solve_one(self, problem, figure_store):
+        return self.solve_batch_results([problem], [figure_store])[0]
 
-    def __classify_problem(self):
-        for ProblemClass in Agent.PROBLEM_CLASSES:
-            if ProblemClass.is_class(self.problem_figures):
-                print self.problem.name + ' class: ' \
-                      + str(ProblemClass.__name__)
-                return ProblemClass
-        print self.problem.name + ' class: None'
-        return None
+    def solve_batch(self, problems, figure_stores=None):
+        """Solves several problems at once.
+
+        Args:
+            problems (list): The problems to solve, as RavensProblem.
+            figure_stores (list): A FigureStore or None for every problem,
+                as for Solve.
+
+        Return:
+            (list): The answer to every problem, in the order given.
+        """
 
-    def __get_problem_data(self):
-        for figure in self.problem.figures.itervalues():
-            image = Image.open(figure.visualFilename)
-            image_data = ImageUtils.get_image_data(image)
-            self.problem_figures[figure.name] = image_data
+        return [result.answer
+                for result in self.solve_batch_results(problems,
+                                                       figure_stores)]
+
+    def solve_batch_results(self, problems, figure_stores=None):
+        """Same as solve_batch, returning a SolveResult for every problem.
+
+        Problems are solved batch_size at a time. The masks of a batch's
+        problems are stacked into one (problems x figures x pixels)
+        ProblemBatch, classified together and solved together per problem
+        class; only the transformation fallback runs problem by problem.
+        Nothing about the problems is kept on the agent, and the timings of
+        every result are passed to timings_hook.
+        """
+
+        if figure_stores is None:
+            figure_stores = [None] * len(problems)
+        results = []
+        for start in range(0, len(problems), self.batch_size):
+            end = start + self.batch_size
+            results.extend(self.__solve_batch(problems[start:end],
+                                              figure_stores[start:end]))
+        return results
+
+    def __solve_batch(self, problems, figure_stores):
+        start = clock()
+        results = [SolveResult(problem) for problem in problems]
+        pending = []
+        for result, figure_store in zip(results, figure_stores):
+            if Agent.is_skipped(result.problem):
+                if figure_store is not None:
+                    figure_store.release()
+                result.answer = Base.SKIP
+                result.solved_by = Agent.SOLVED_BY_SKIP
+            else:
+                if figure_store is None:
+                    figure_store = self.create_figure_store(result.problem)
+                pending.append((result, figure_store))
+
+        try:
+            if pending:
+                self.__solve_pending(pending)
+        finally:
+            for _result, figure_store in pending:
+                figure_store.release()
+
+        # Time outside the recorded stages is shared evenly.
+        overhead = (clock() - start - sum(
+            result.timings.decode + result.timings.classify +
+            result.timings.solve + result.timings.fallback
+            for result in results)) / len(results)
+        for result in results:
+            timings = result.timings
+            timings.solved_by = result.solved_by
+            timings.total = timings.decode + timings.classify + \
+                timings.solve + timings.fallback + overhead
+            if self.timings_hook is not None:
+                self.timings_hook(timings)
+        return results
+
+    def __solve_pending(self, pending):
+        """Solves the problems that are not skipped, as (SolveResult,
+        FigureStore) pairs. Stage times spent on a whole batch are shared
+        evenly by its problems."""
+
+        problems_figures = []
+        for result, figure_store in pending:
+            start = clock()
+            problems_figures.append(figure_store.get_masks())
+            result.timings.decode = clock() - start
+        start = clock()
+        thresholds = (Unchanged.MATCH_FRACTION_THRESHOLD,
+                      Unchanged.COUNT_RATIO_THRESHOLD) \
+            if self.prune else None
+        batches = ProblemBatch.split(problems_figures, thresholds,
+                                     self.coarse_to_fine, self.align)
+        Agent.__share_time(pending, range(len(pending)), 'decode',
+                           clock() - start)
+
+        for indices, batch in batches:
+            engine = ClassificationEngine(batch)
+            problem_classes = engine.classify(Agent.PROBLEM_CLASSES)
+            for i, problem_class, scores in \
+                    zip(indices, problem_classes, engine.scores):
+                result = pending[i][0]
+                result.problem_class = problem_class
+                result.classification_scores = scores
+                for class_name, seconds in engine.seconds_by_class:
+                    result.timings.add_classify(class_name,
+                                                seconds / len(indices))
+
+        for result, _figure_store in pending:
+            print result.problem.name + ' class: ' + \
+                (str(result.problem_class.__name__)
+                 if result.problem_class else 'None')
+
+        for indices, batch in batches:
+            for ProblemClass in Agent.PROBLEM_CLASSES:
+                members = [k for k, i in enumerate(indices)
+                           if pending[i][0].problem_class is ProblemClass]
+                if not members:
+                    continue
+                start = clock()
+                answers = ProblemClass.solve_batch(batch, members)
+                Agent.__share_time(pending, [indices[k] for k in members],
+                                   'solve', clock() - start)
+                for k, answer in zip(members, answers):
+                    result = pending[indices[k]][0]
+                    result.answer = answer
+                    result.solved_by = ProblemClass.__name__
+            if batch.stage_counts is not None:
+                for k, i in enumerate(indices):
+                    pending[i][0].comparisons_by_stage = \
+                        batch.comparisons_by_stage(k)
+
+        for result, figure_store in pending:
+            if result.problem_class is None:
+                start = clock()
+                result.answer = self.transformation_match_percentage_strategy(
+                    result.problem, figure_store)
+                result.solved_by = Agent.SOLVED_BY_TRANSFORM
+                result.timings.fallback = clock() - start
+
+    @staticmethod
+    def __share_time(pending, indices, stage, seconds):
+        for i in indices:
+            timings = pending[i][0].timings
+            setattr(timings, stage,
+                    getattr(timings, stage) + seconds / len(indices))
 
-    def transformation_match_percentage_strategy(self):
+    def transformation_match_percentage_strategy(self, problem,
+                                                 figure_store=None):
         solution_map = {'AC': 'G', 'DF': 'G', 'AG': 'C', 'BH': 'C'}
-        problem_figures, solution_figures = \
-            Agent.generate_problem_images(self.problem)
+        if figure_store is None:
+            problem_figures, solution_figures = \
+                Agent.generate_problem_images(problem)
+        else:
+            problem_figures, solution_figures = \
+                figure_store.get_problem_images()
 
         closest_match = {'name': '-1', 'difference': 2.00}
 
@@ -102,14 +312,22 @@ class Agent:
             images_transformations = \
                 Transform.generate_transforms_data(image1_data, image2_data)
             apply_to_image_data = problem_figures[apply_to]
+            # Score the transformed apply_to image against every solution at
+            # once; the transformed image is built once and cached.
+            solution_names = solution_figures.keys()
+            solution_matches = {}
+            for transformation in images_transformations.itervalues():
+                solution_matches[transformation.name] = dict(zip(
+                    solution_names, transformation.apply_and_compare_all(
+                        apply_to_image_data,
+                        [solution_figures[name] for name in solution_names])))
             # Loop over each solution image.
-            for solution_name, solution_image_data in \
-                    solution_figures.iteritems():
+            for solution_name in solution_figures.iterkeys():
                 # Loop over each transformation and see if the transformations
                 # match up.
                 for transformation in images_transformations.itervalues():
-                    apply_to_image_match = transformation.apply_and_compare(
-                        apply_to_image_data, solution_image_data)
+                    apply_to_image_match = \
+                        solution_matches[transformation.name][solution_name]
                     match_difference = \
                         math.fabs(apply_to_image_match - transformation.match)
                     if match_difference < closest_match['difference']:
@@ -0,0 +1,142 @@
+import numpy as np
+
+from SimilarityTable import pairwise_count_ratios
+
+# Largest shift, in pixels along either axis, that aligned matching tries.
+MAX_SHIFT = 8
+
+
+def figure_shape(num_pixels):
+    """(height, width) of a flat figure mask. RPM figures are square."""
+
+    side = int(round(np.sqrt(num_pixels)))
+    if side * side != num_pixels:
+        raise ValueError('aligned matching needs square figures, not %d '
+                         'pixels' % num_pixels)
+    return side, side
+
+
+class SpectrumCache:
+    """Spectra of a problem's figures for FFT cross-correlation.
+
+    Every figure is zero-padded by MAX_SHIFT along both axes, so circular
+    correlation equals linear correlation for every shift aligned matching
+    tries, and transformed once however many pairs it is part of. Only the
+    correlations at those shifts are transformed back: the rows of the
+    inverse transform at the vertical shifts are summed directly, and only
+    those rows are inverted along the other axis.
+    """
+
+    def __init__(self, rows, num_pixels, packed):
+        """
+        Args:
+            rows (numpy.ndarray): The problem's figures, laid out like
+                SimilarityTable.rows.
+            num_pixels (int): Number of pixels in every figure.
+            packed (bool): Whether rows holds packed bits.
+        """
+
+        self.rows = rows
+        self.num_pixels = num_pixels
+        self.packed = packed
+        self.shape = figure_shape(num_pixels)
+        self.fft_shape = tuple(size + MAX_SHIFT for size in self.shape)
+        self.spectra = {}
+        lags = np.arange(-MAX_SHIFT, MAX_SHIFT + 1)
+        # Inverse transform along the first axis, at the vertical shifts.
+        self.inverse_rows = np.exp(
+            2j * np.pi * np.outer(lags, np.arange(self.fft_shape[0])) /
+            self.fft_shape[0]) / self.fft_shape[0]
+
+    def get(self, i):
+        """Returns the spectrum of figure i."""
+
+        spectrum = self.spectra.get(i)
+        if spectrum is None:
+            mask = self.rows[i]
+            if self.packed:
+                mask = np.unpackbits(mask)[:self.num_pixels]
+            spectrum = np.fft.rfft2(
+                mask.reshape(self.shape).astype(np.float64), self.fft_shape)
+            self.spectra[i] = spectrum
+        return spectrum
+
+    def overlaps(self, i, others):
+        """Black pixels figure i shares with each of the figures others,
+        shifted by every offset of SHIFTS.
+
+        Return:
+            (numpy.ndarray): (others x len(SHIFTS)) shared black pixels.
+        """
+
+        spectrum = self.get(i)
+        products = np.stack([spectrum * np.conj(self.get(j))
+                             for j in others])
+        # correlation[dy, dx] = sum of mask_i[y + dy, x + dx] * mask_j[y, x],
+        # laid out (others x vertical shifts x columns).
+        correlation = np.fft.irfft(np.matmul(self.inverse_rows, products),
+                                   self.fft_shape[1], axis=-1)
+        return np.rint(correlation[:, SHIFTS[:, 0] + MAX_SHIFT,
+                                   SHIFTS[:, 1]]).astype(np.int64)
+
+
+def all_shifts():
+    """Every (dy, dx) offset of at most MAX_SHIFT, nearest first, so that
+    ties between offsets go to the smallest shift."""
+
+    offsets = np.arange(-MAX_SHIFT, MAX_SHIFT + 1)
+    shifts = np.stack(np.meshgrid(offsets, offsets, indexing='ij'),
+                      axis=-1).reshape(-1, 2)
+    order = np.argsort(np.abs(shifts).sum(axis=1), kind='mergesort')
+    return shifts[order]
+
+
+SHIFTS = all_shifts()
+
+
+def aligned_pairwise_stats(rows, black_counts, num_pixels, packed):
+    """Same as SimilarityTable.pairwise_stats, comparing every pair of
+    figures at the offset where they match best.
+
+    Figures are compared on an unbounded white canvas: shifting a figure
+    never drops black pixels, so the match statistics stay symmetric and the
+    count ratios are the unshifted ones. Figure j is shifted against figure
+    i by every offset of up to MAX_SHIFT pixels along each axis, and the
+    black pixels they share at each offset are read off one FFT
+    cross-correlation per pair.
+
+    Args:
+        rows (numpy.ndarray): Figures laid out like SimilarityTable.rows,
+            with a leading problem axis.
+        black_counts (numpy.ndarray): Black pixels of every figure.
+        num_pixels (int): Number of pixels in every figure.
+        packed (bool): Whether rows holds packed bits.
+
+    Return:
+        (numpy.ndarray): Match fractions at the best offsets.
+        (numpy.ndarray): Count ratios.
+        (numpy.ndarray): The best (dy, dx) offset of figure j against
+            figure i, as last axis.
+    """
+
+    num_problems, num_figures = rows.shape[:2]
+    counts = black_counts.astype(np.int64)
+    match_fractions = np.ones((num_problems, num_figures, num_figures))
+    offsets = np.zeros((num_problems, num_figures, num_figures, 2),
+                       dtype=np.int64)
+
+    pairs_i, pairs_j = np.triu_indices(num_figures, 1)
+    for p in range(num_problems):
+        spectra = SpectrumCache(rows[p], num_pixels, packed)
+        overlaps = np.concatenate([
+            spectra.overlaps(i, range(i + 1, num_figures))
+            for i in range(num_figures - 1)])
+        best = overlaps.argmax(axis=1)
+        mismatches = counts[p, pairs_i] + counts[p, pairs_j] - \
+            2 * overlaps[np.arange(len(best)), best]
+        fractions = (num_pixels - mismatches) / float(num_pixels)
+        match_fractions[p, pairs_i, pairs_j] = fractions
+        match_fractions[p, pairs_j, pairs_i] = fractions
+        offsets[p, pairs_i, pairs_j] = SHIFTS[best]
+        offsets[p, pairs_j, pairs_i] = -SHIFTS[best]
+    return match_fractions, pairwise_count_ratios(black_counts), offsets
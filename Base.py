@@ -73,3 +73,13 @@ class Base:
 
     def solve(self):
         raise NotImplementedError
+
+    @classmethod
+    def solve_batch(cls, batch, indices):
+        """Solves the problems of a ProblemBatch at the given indices.
+
+        Return:
+            (list): The answer to each problem, in the order of indices.
+        """
+
+        return [cls(batch.problems_figures[i]).solve() for i in indices]
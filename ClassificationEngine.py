@@ -0,0 +1,199 @@
+import collections
+
+import numpy as np
+
+from Base import Base
+from Disjunction import Disjunction
+from Intersection import Intersection
+from PixelAddition import PixelAddition
+from PixelSubtraction import PixelSubtraction
+from Pruning import refined_operator_stats
+from SolveTimings import clock
+from Unchanged import Unchanged
+from Union import Union
+
+LOGICAL_CLASSES = [Union, Intersection, Disjunction]
+COUNT_CLASSES = [PixelSubtraction, PixelAddition]
+
+
+class ClassificationEngine:
+    """Evaluates every problem class hypothesis of a ProblemBatch in one pass.
+
+    The trans and test triples of all of Base.TRANS_GROUPS are gathered from
+    the batch's rows once, for every problem at the same time. Identity is
+    read from the batch's pairwise statistics, the logical operators are
+    applied to all triples of all problems at once and the pixel count
+    operators work on the figures' black counts (ProblemFigures.summaries).
+    The decisions are the same as each class's is_class would make, and the
+    statistics behind them are kept in scores. In a pruned batch the
+    statistics of comparisons that cannot match are upper bounds.
+    """
+
+    def __init__(self, batch):
+        """
+        Args:
+            batch (ProblemBatch): The problems to classify.
+        """
+
+        self.batch = batch
+        # For every problem, the evaluated problem class names mapped to one
+        # entry per trans group: dict(group, match, trans, test) where trans
+        # and test are the statistics is_class compares against its
+        # thresholds.
+        self.scores = [collections.OrderedDict() for _ in range(len(batch))]
+        # (class name, seconds) for every evaluated problem class, for the
+        # whole batch.
+        self.seconds_by_class = []
+
+    def classify(self, problem_classes):
+        """Returns, for every problem, the first of problem_classes whose
+        is_class holds.
+
+        Every known hypothesis is evaluated, so scores is complete even when
+        an early class matches. Classes the engine does not know are asked
+        through their own is_class.
+
+        Return:
+            (list): The matching problem class of every problem, or None.
+        """
+
+        matches = self.evaluate()
+        for problem_class in problem_classes:
+            name = problem_class.__name__
+            if name not in matches[0]:
+                start = clock()
+                for problem_matches, problem_figures in \
+                        zip(matches, self.batch.problems_figures):
+                    problem_matches[name] = \
+                        problem_class.is_class(problem_figures)
+                self.seconds_by_class.append((name, clock() - start))
+
+        classes = []
+        for problem_matches in matches:
+            classes.append(next(
+                (problem_class for problem_class in problem_classes
+                 if problem_matches[problem_class.__name__]), None))
+        return classes
+
+    def evaluate(self):
+        """Evaluates every known hypothesis for every trans group.
+
+        Return:
+            (list): For every problem, whether is_class holds, keyed by
+                problem class name.
+        """
+
+        start = clock()
+        batch = self.batch
+        for problem_scores in self.scores:
+            problem_scores.clear()
+        del self.seconds_by_class[:]
+        # Triples in the order trans, test for each trans group.
+        triples = []
+        for trans_group in Base.TRANS_GROUPS:
+            triples.append(trans_group)
+            triples.append(Base.TRANS_TO_TEST_MAP[trans_group])
+        first, second, result = [
+            batch.get_indices([triple[k] for triple in triples])
+            for k in range(3)]
+
+        # (problems x triples x pairs) statistics of the pairs 1-2 and 2-3.
+        fractions = np.stack([batch.match_fractions[:, first, second],
+                              batch.match_fractions[:, second, result]],
+                             axis=-1)
+        ratios = np.stack([batch.count_ratios[:, first, second],
+                           batch.count_ratios[:, second, result]], axis=-1)
+        pair_matches = \
+            Unchanged.are_stats_match(fractions, ratios).all(axis=-1)
+        self.__add_scores(Unchanged, pair_matches, fractions, ratios, start)
+
+        start = clock()
+        for problem_class in LOGICAL_CLASSES:
+            fractions, ratios = self.__operator_stats(problem_class, first,
+                                                      second, result)
+            triple_matches = Unchanged.are_stats_match(fractions, ratios)
+            self.__add_scores(problem_class, triple_matches, fractions,
+                              ratios, start)
+            start = clock()
+
+        for problem_class in COUNT_CLASSES:
+            percents = []
+            triple_matches = []
+            for problem_figures in batch.problems_figures:
+                problem_percents = []
+                problem_matches = []
+                for triple in triples:
+                    counts = [problem_figures.black_count(name)
+                              for name in triple]
+                    post_op = problem_class.do_count_operator(counts[0],
+                                                              counts[1])
+                    problem_percents.append(
+                        problem_class.match_percent(post_op, counts[2]))
+                    problem_matches.append(
+                        problem_class.is_count_operator(*counts))
+                percents.append(problem_percents)
+                triple_matches.append(problem_matches)
+            self.__add_scores(problem_class, triple_matches, percents, None,
+                              start)
+            start = clock()
+
+        return [dict((name, any(score['match'] for score in group_scores))
+                     for name, group_scores in problem_scores.iteritems())
+                for problem_scores in self.scores]
+
+    def __operator_stats(self, problem_class, first, second, result):
+        """Match statistics between the operator applied to the first and
+        second figures of every triple and its third figure, laid out
+        (problems x triples). In a pruned batch, triples that cannot match
+        only get upper bounds."""
+
+        batch = self.batch
+        if batch.thresholds is not None:
+            shape = (len(batch), len(first))
+            problems, triples = [index.ravel() for index in np.indices(shape)]
+            fractions, ratios, levels = refined_operator_stats(
+                problem_class.do_row_operator, problem_class.block_bounds,
+                batch.rows, batch.black_counts, batch.extents,
+                batch.num_pixels, batch.packed, batch.pyramids,
+                batch.thresholds, problems, first[triples], second[triples],
+                result[triples])
+            batch.count_stages(problems, levels)
+            return fractions.reshape(shape), ratios.reshape(shape)
+
+        post_op = problem_class.do_row_operator(batch.rows[:, first],
+                                                batch.rows[:, second])
+        post_op_counts = batch.count_black(post_op, axis=-1)
+        mismatches = batch.count_black(post_op ^ batch.rows[:, result],
+                                       axis=-1)
+        result_counts = batch.black_counts[:, result].astype(np.int64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratios = \
+                np.minimum(post_op_counts, result_counts) / \
+                np.maximum(post_op_counts, result_counts).astype(np.float64)
+        return (batch.num_pixels - mismatches) / float(batch.num_pixels), \
+            ratios
+
+    def __add_scores(self, problem_class, triple_matches, fractions, ratios,
+                     start):
+        """Records a class's per group scores from its per triple results,
+        laid out (problems x triples) like the triples in evaluate."""
+
+        for i, problem_scores in enumerate(self.scores):
+            group_scores = []
+            for j, trans_group in enumerate(Base.TRANS_GROUPS):
+                stats = []
+                for triple in (2 * j, 2 * j + 1):
+                    if ratios is None:
+                        stats.append(float(fractions[i][triple]))
+                    else:
+                        stats.append(np.stack(
+                            [fractions[i][triple], ratios[i][triple]],
+                            axis=-1).tolist())
+                group_scores.append(dict(
+                    group=trans_group,
+                    match=bool(triple_matches[i][2 * j] and
+                               triple_matches[i][2 * j + 1]),
+                    trans=stats[0],
+                    test=stats[1]))
+            problem_scores[problem_class.__name__] = group_scores
+        self.seconds_by_class.append((problem_class.__name__, clock() - start))
@@ -1,9 +1,23 @@
 from LogicalOperator import LogicalOperator
+from PackedMask import PackedMask
+import numpy as np
 
 
 class Disjunction(LogicalOperator):
     @staticmethod
     def do_operator(fig_1, fig_2):
+        if isinstance(fig_1, PackedMask):
+            return fig_1 ^ fig_2
         disjunction = fig_1 + fig_2
         disjunction[disjunction > 1] = 0
         return disjunction
+
+    @staticmethod
+    def do_row_operator(rows_1, rows_2):
+        return rows_1 ^ rows_2
+
+    @staticmethod
+    def block_bounds(blocks_1, blocks_2, block_size):
+        return np.abs(blocks_1 - blocks_2), \
+            np.minimum(blocks_1 + blocks_2,
+                       2 * block_size - blocks_1 - blocks_2)
@@ -0,0 +1,135 @@
+from PIL import Image
+
+from Base import Base
+from FigureSummary import FigureSummary
+from ImageUtils import ImageUtils
+from InMemoryProblem import InMemoryFigure
+from PackedMask import PackedMask
+from ProblemFigures import ProblemFigures
+
+
+class FigureStore:
+    """Decoded figures of a single problem.
+
+    Every figure file is opened and decoded at most once. The binary mask
+    view used by the problem classes and the image view used by Transform
+    are both derived from that one decode, on demand. Call release() once
+    the problem is solved to drop everything the store holds.
+
+    When a MaskCache is given, masks are read from it and the PNG is only
+    opened if the image view is requested or the cache misses. With packed
+    set, masks are served as PackedMask instead of np.int_ arrays. Every
+    mask is summarized (FigureSummary) as soon as it is decoded, including
+    its Pyramid if pyramids is set.
+
+    When a ProblemBundle is given, masks and images are read from it
+    instead, and only figures the bundle lacks are opened from disk.
+
+    Figures held in memory (InMemoryFigure) are read from the figure alone,
+    bypassing both, and images they hand over are left open on release().
+    """
+
+    def __init__(self, problem, mask_cache=None, packed=False,
+                 pyramids=False, bundle=None):
+        self.problem = problem
+        self.mask_cache = mask_cache if bundle is None else bundle
+        self.bundle = bundle
+        self.packed = packed
+        self.pyramids = pyramids
+        self.images = {}
+        self.masks = {}
+        self.summaries = {}
+        self.images_data = {}
+
+    def get_image(self, name):
+        """Returns the figure as a loaded PIL image."""
+
+        image = self.images.get(name)
+        if image is None:
+            figure = self.problem.figures[name]
+            visual_filename = figure.visualFilename
+            if isinstance(figure, InMemoryFigure):
+                image = figure.open_image()
+            elif self.bundle is not None:
+                image = self.bundle.open_image(visual_filename)
+            if image is None:
+                image = Image.open(visual_filename)
+            image.load()
+            self.images[name] = image
+        return image
+
+    def get_mask(self, name):
+        """Returns the figure as a binary mask (1 = black pixel)."""
+
+        mask = self.masks.get(name)
+        if mask is None:
+            figure = self.problem.figures[name]
+            in_memory = isinstance(figure, InMemoryFigure)
+            if in_memory and figure.mask is not None:
+                mask = figure.get_mask(self.packed)
+            elif self.mask_cache is not None and not in_memory:
+                mask = self.mask_cache.get(
+                    figure.visualFilename,
+                    lambda: self.__decode_mask(name), self.packed)
+            elif self.packed:
+                mask = PackedMask.pack(self.__decode_mask(name))
+            else:
+                mask = self.__decode_mask(name)
+            self.masks[name] = mask
+            self.summaries[name] = FigureSummary.of(mask, self.pyramids)
+        return mask
+
+    def __decode_mask(self, name):
+        return ImageUtils.get_image_data(self.get_image(name))
+
+    def get_masks(self):
+        """Returns every figure's binary mask, with its summary, as
+        ProblemFigures."""
+
+        names = list(self.problem.figures.iterkeys())
+        masks = [(name, self.get_mask(name)) for name in names]
+        return ProblemFigures(masks, summaries=dict(
+            (name, self.summaries[name]) for name in names))
+
+    def get_image_data(self, name):
+        """Returns the figure's image data in the form dict(image) as used by
+        Transform. The same dictionary is returned on every call so the
+        transform variants cached in it are shared."""
+
+        image_data = self.images_data.get(name)
+        if image_data is None:
+            image_data = dict(image=self.get_image(name))
+            self.images_data[name] = image_data
+        return image_data
+
+    def get_problem_images(self):
+        """Splits the image data into problem and solution figures.
+
+        Return:
+            (dict): Dictionary of problem figures.
+            (dict): Dictionary of solution figures.
+        """
+
+        problem_figures = {}
+        solution_figures = {}
+        for figure in self.problem.figures.itervalues():
+            if figure.name in Base.PROBLEM_FIGURE_KEYS:
+                problem_figures[figure.name] = \
+                    self.get_image_data(figure.name)
+            elif figure.name in Base.SOLUTION_FIGURE_KEYS:
+                solution_figures[figure.name] = \
+                    self.get_image_data(figure.name)
+        return problem_figures, solution_figures
+
+    def release(self):
+        """Closes the images and drops every decoded view."""
+
+        for name, image in self.images.iteritems():
+            figure = self.problem.figures[name]
+            if not isinstance(figure, InMemoryFigure) or \
+                    image is not figure.image:
+                image.close()
+        self.images.clear()
+        self.masks.clear()
+        self.summaries.clear()
+        self.images_data.clear()
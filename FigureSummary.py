@@ -0,0 +1,64 @@
+import numpy as np
+
+from PackedMask import PackedMask
+from Pyramid import Pyramid
+
+
+class FigureSummary:
+    """Constant-size facts about one figure mask.
+
+    Summaries are computed once, when the mask is decoded, so the problem
+    classes that only need a figure's black pixel count never scan its
+    pixels again. The black extent, the first and last black pixel of the
+    flat mask, bounds where the figure's black pixels are (see Pruning); a
+    blank figure's extent is (num_pixels, -1).
+    """
+
+    @staticmethod
+    def of(mask, pyramid=False):
+        """Summarizes a flat binary mask or a PackedMask, with its Pyramid if
+        pyramid is set."""
+
+        pyramid = Pyramid.of(mask) if pyramid else None
+        if isinstance(mask, PackedMask):
+            return FigureSummary(mask.num_pixels, mask.black_count(),
+                                 FigureSummary.__packed_extent(mask), pyramid)
+        black = np.flatnonzero(mask)
+        extent = (black[0], black[-1]) if len(black) else (len(mask), -1)
+        return FigureSummary(len(mask), np.sum(mask), extent, pyramid)
+
+    @staticmethod
+    def __packed_extent(mask):
+        black_bytes = np.flatnonzero(mask.bits)
+        if not len(black_bytes):
+            return mask.num_pixels, -1
+        first, last = black_bytes[0], black_bytes[-1]
+        # Pixels are packed most significant bit first.
+        first_bits = np.unpackbits(mask.bits[first:first + 1])
+        last_bits = np.unpackbits(mask.bits[last:last + 1])
+        return 8 * first + first_bits.argmax(), \
+            8 * last + 7 - last_bits[::-1].argmax()
+
+    def __init__(self, num_pixels, black_count, black_extent, pyramid=None):
+        """
+        Args:
+            num_pixels (int): Number of pixels in the figure.
+            black_count (numpy.int64): Number of black pixels. Kept as a
+                NumPy integer so count arithmetic behaves as it does on
+                np.sum results.
+            black_extent (tuple): Flat indices of the first and last black
+                pixels.
+            pyramid (Pyramid): Block counts of the figure, for coarse to fine
+                matching.
+        """
+
+        self.num_pixels = num_pixels
+        self.black_count = black_count
+        self.black_extent = black_extent
+        self.pyramid = pyramid
+
+    @property
+    def black_fraction(self):
+        """Fraction of the figure's pixels that are black."""
+
+        return float(self.black_count) / float(self.num_pixels)
@@ -1,11 +1,47 @@
+import itertools
+
 import numpy as np
+from PIL import Image
 
 BLACK_PIXEL = (0, 0, 0, 255)
 
+# BLACK_PIXEL packed into a single little-endian 32 bit word so a whole RGBA
+# buffer can be compared in one vectorized operation.
+BLACK_PIXEL_WORD = np.frombuffer(bytearray(BLACK_PIXEL), dtype='<u4')[0]
+
 
 class ImageUtils:
+    @staticmethod
+    def get_image_mask(image):
+        """Decodes an image into a compact black pixel mask.
+
+        The RGBA buffer is read straight out of PIL and compared as packed 32
+        bit words, so no per-pixel Python objects are created. Images without
+        four bands never match BLACK_PIXEL, exactly as in the pixel-wise
+        comparison.
+
+        Args:
+            image (PIL.Image): The image to decode.
+
+        Return:
+            (numpy.ndarray): Flat boolean array, True for black pixels.
+        """
+
+        if len(image.getbands()) != len(BLACK_PIXEL):
+            return np.zeros(image.size[0] * image.size[1], dtype=np.bool_)
+
+        words = np.frombuffer(image.tobytes(), dtype='<u4')
+        return words == BLACK_PIXEL_WORD
+
     @staticmethod
     def get_image_data(image):
+        return np.int_(ImageUtils.get_image_mask(image))
+
+    @staticmethod
+    def get_image_data_pixelwise(image):
+        """Reference decoder that walks every pixel in Python. Kept to verify
+        get_image_data against (see verify.py)."""
+
         image_data = []
 
         for pixel in image.getdata():
@@ -16,35 +52,103 @@ class ImageUtils:
 
         return np.int_(image_data)
 
+    @staticmethod
+    def get_pixel_array(pixels):
+        """Normalizes pixels to a flat array holding one comparable element
+        per pixel.
+
+        One dimensional arrays and lists (e.g. decoded masks) are returned as
+        arrays unchanged. Anything with a trailing band axis (PIL images,
+        RGBA arrays, lists of RGBA tuples, PIL pixel sequences from
+        Image.getdata()) is packed so each pixel becomes a single element.
+        Pass the image itself rather than its getdata() when there is one:
+        its buffer is read directly instead of pixel by pixel.
+
+        Args:
+            pixels: A mask, a PIL image, an RGBA array, a list of pixels or
+                a PIL pixel sequence.
+
+        Return:
+            (numpy.ndarray): Flat array with one element per pixel.
+        """
+
+        if not isinstance(pixels, np.ndarray):
+            if isinstance(pixels, Image.Image):
+                pixels = np.asarray(pixels).reshape(
+                    -1, len(pixels.getbands()))
+            elif len(pixels) and isinstance(pixels[0], tuple):
+                pixels = ImageUtils.__pixel_tuples_to_array(pixels)
+            else:
+                pixels = np.asarray(pixels)
+
+        if pixels.ndim <= 1:
+            return pixels
+
+        bands = pixels.shape[-1]
+        if bands == 1:
+            return pixels.reshape(-1)
+        if pixels.dtype.kind in 'iu':
+            pixels = pixels.astype(np.uint8, copy=False)
+        pixels = np.ascontiguousarray(pixels.reshape(-1, bands))
+        if bands == 4 and pixels.dtype == np.uint8:
+            return pixels.view('<u4').reshape(-1)
+        return pixels.view(
+            np.dtype((np.void, pixels.dtype.itemsize * bands))).reshape(-1)
+
+    @staticmethod
+    def get_pixel_grid(image):
+        """Returns the image's pixels as a (height, width) array holding one
+        comparable element per pixel (see get_pixel_array)."""
+
+        width, height = image.size
+        pixels = np.asarray(image).reshape(width * height, -1)
+        return ImageUtils.get_pixel_array(pixels).reshape(height, width)
+
+    @staticmethod
+    def __pixel_tuples_to_array(pixels):
+        # Flattening into a bytearray is several times faster than letting
+        # NumPy infer the shape of a list of tuples.
+        try:
+            buf = bytearray(itertools.chain.from_iterable(pixels))
+        except (TypeError, ValueError):
+            return np.asarray(pixels)
+        return np.frombuffer(buf, dtype=np.uint8).reshape(len(pixels), -1)
+
     @staticmethod
     def match_percentage(image1_pixels, image2_pixels):
         """Compares two image's pixels and returns the percentage that those
         two pixel lists match.
 
         Args:
-            image1_pixels (list): A list of pixels in an image.
-            image2_pixels (list): A list of pixels in an image.
+            image1_pixels: A mask, RGBA array or list of pixels in an image.
+            image2_pixels: A mask, RGBA array or list of pixels in an image.
 
         Return:
             (float): Percentage the two pixel lists match.
         """
 
-        match, total = 0, 0
-        for i in range(len(image1_pixels)):
-            if image1_pixels[i] == image2_pixels[i]:
-                match += 1
-                total += 1
-            else:
-                total += 1
-        return float(match) / float(total)
+        pixels_1 = ImageUtils.get_pixel_array(image1_pixels)
+        pixels_2 = ImageUtils.get_pixel_array(image2_pixels)[:len(pixels_1)]
+        if len(pixels_2) < len(pixels_1):
+            raise IndexError('second pixel list is shorter than the first')
+
+        match = np.count_nonzero(pixels_1 == pixels_2)
+        return float(match) / float(len(pixels_1))
 
     @staticmethod
     def black_pixel_count(image_pixels):
-        black = 0
-        for i in range(len(image_pixels)):
-            if image_pixels[i] == (0, 0, 0, 255):
-                black += 1
-        return black
+        """Counts the black pixels in a mask, RGBA array or list of pixels."""
+
+        if isinstance(image_pixels, (list, tuple)) and not \
+                (len(image_pixels) and isinstance(image_pixels[0], tuple)):
+            image_pixels = np.asarray(image_pixels)
+        if isinstance(image_pixels, np.ndarray) and image_pixels.ndim == 1:
+            return int(np.count_nonzero(image_pixels))
+
+        pixels = ImageUtils.get_pixel_array(image_pixels)
+        black = ImageUtils.get_pixel_array(
+            np.array([BLACK_PIXEL], dtype=np.uint8))
+        return int(np.count_nonzero(pixels == black[0]))
 
     def __init__(self):
         pass
@@ -0,0 +1,130 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from ImageUtils import BLACK_PIXEL
+from PackedMask import PackedMask
+from RavensFigure import RavensFigure
+from RavensProblem import RavensProblem
+
+WHITE_PIXEL = (255, 255, 255, 255)
+
+
+class InMemoryFigure(RavensFigure):
+    """A figure whose pixels are held in memory instead of a PNG file under
+    the Problems directory.
+
+    The pixels are given as exactly one of a PIL image, the bytes of a PNG
+    file or a binary mask. FigureStore reads them straight from the figure:
+    masks are used as they are, images are decoded like figure files, and
+    nothing is looked up in a MaskCache or ProblemBundle, so visualFilename
+    (which RavensFigure always sets) is never opened.
+    """
+
+    def __init__(self, name, problemName, setName, image=None, png=None,
+                 mask=None, shape=None):
+        """
+        Args:
+            name (str): Name of the figure, e.g. 'A' or '1'.
+            problemName (str): Name of the figure's problem.
+            setName (str): Name of the problem's set.
+            image (PIL.Image): The figure as an RGBA image, black pixels
+                being (0, 0, 0, 255).
+            png (str): The bytes of the figure's PNG file.
+            mask: The figure as a binary mask (non-zero = black pixel): a
+                PackedMask, or a flat or (height, width) array.
+            shape (tuple): (height, width) of a flat mask. Defaults to a
+                square. Only needed to draw the mask as an image.
+        """
+
+        RavensFigure.__init__(self, name, problemName, setName)
+        if sum(source is not None for source in (image, png, mask)) != 1:
+            raise ValueError('figure %s needs exactly one of image, png or '
+                             'mask' % name)
+        self.image = image
+        self.png = png
+        self.shape = shape
+        self.mask = None
+        if isinstance(mask, PackedMask):
+            self.mask = mask
+        elif mask is not None:
+            mask = np.asarray(mask)
+            if mask.ndim == 2:
+                self.shape = mask.shape
+            self.mask = np.int_(mask.reshape(-1) != 0)
+
+    def open_image(self):
+        """Returns the figure as a PIL image.
+
+        A given image is returned as it is. A mask is drawn with black and
+        white pixels only, so the Transform strategy, which compares every
+        pixel's color, can answer differently than on the original PNG.
+        """
+
+        if self.image is not None:
+            return self.image
+        if self.png is not None:
+            return Image.open(io.BytesIO(self.png))
+
+        mask = self.mask
+        if isinstance(mask, PackedMask):
+            mask = mask.unpack()
+        height, width = self.shape or (int(round(np.sqrt(len(mask)))),) * 2
+        if height * width != len(mask):
+            raise ValueError('figure %s has %d pixels, not %dx%d' % (
+                self.name, len(mask), height, width))
+        pixels = np.where(mask[:, np.newaxis] != 0,
+                          np.array(BLACK_PIXEL, dtype=np.uint8),
+                          np.array(WHITE_PIXEL, dtype=np.uint8))
+        return Image.fromarray(pixels.reshape(height, width, 4), 'RGBA')
+
+    def get_mask(self, packed):
+        """Returns the given mask, packed or as a flat np.int_ array, or None
+        if the figure was given as an image."""
+
+        if self.mask is None:
+            return None
+        if isinstance(self.mask, PackedMask):
+            return self.mask if packed else self.mask.unpack()
+        return PackedMask.pack(self.mask) if packed else self.mask
+
+
+class InMemoryProblem(RavensProblem):
+    """A RavensProblem built from figures held in memory, e.g. produced by a
+    generator or received over a socket, which Agent solves without reading
+    or writing any file.
+
+    Agent.Solve only solves problems of the sets it knows (see
+    Agent.is_skipped), so problemSetName should end with one of
+    Agent.PROBLEM_SETS.
+    """
+
+    def __init__(self, name, problemType, problemSetName, figures,
+                 hasVerbal=False):
+        """
+        Args:
+            name (str): Name of the problem.
+            problemType (str): '2x2' or '3x3'.
+            problemSetName (str): Name of the problem's set.
+            figures (dict): Every figure by name: a PIL image, the bytes of a
+                PNG file, a PackedMask or mask array, or an InMemoryFigure.
+            hasVerbal (bool): Whether the figures carry RavensObjects.
+        """
+
+        RavensProblem.__init__(self, name, problemType, problemSetName, True,
+                               hasVerbal)
+        for figure_name, source in figures.iteritems():
+            if not isinstance(source, InMemoryFigure):
+                source = InMemoryFigure(
+                    figure_name, name, problemSetName,
+                    **InMemoryProblem.__source_kwargs(source))
+            self.figures[figure_name] = source
+
+    @staticmethod
+    def __source_kwargs(source):
+        if isinstance(source, Image.Image):
+            return dict(image=source)
+        if isinstance(source, (bytes, bytearray)):
+            return dict(png=bytes(source))
+        return dict(mask=source)
@@ -1,7 +1,20 @@
 from LogicalOperator import LogicalOperator
+from PackedMask import PackedMask
+import numpy as np
 
 
 class Intersection(LogicalOperator):
     @staticmethod
     def do_operator(fig_1, fig_2):
+        if isinstance(fig_1, PackedMask):
+            return fig_1 & fig_2
         return (fig_1 + fig_2) / 2
+
+    @staticmethod
+    def do_row_operator(rows_1, rows_2):
+        return rows_1 & rows_2
+
+    @staticmethod
+    def block_bounds(blocks_1, blocks_2, block_size):
+        return np.maximum(blocks_1 + blocks_2 - block_size, 0), \
+            np.minimum(blocks_1, blocks_2)
@@ -1,23 +1,29 @@
 from Base import Base
+from ProblemFigures import ProblemFigures
+from Pruning import refined_operator_stats
+from SimilarityTable import match_stats_rows
 from Unchanged import Unchanged
-import operator
+import numpy as np
 
 
 class LogicalOperator(Base):
     @classmethod
     def is_class(cls, problem_figures):
+        problem_figures = ProblemFigures.wrap(problem_figures)
+        table = problem_figures.similarity_table
+
         for trans_group in Base.TRANS_GROUPS:
             trans_1 = problem_figures[trans_group[0]]
             trans_2 = problem_figures[trans_group[1]]
-            trans_3 = problem_figures[trans_group[2]]
 
             test_group = Base.TRANS_TO_TEST_MAP[trans_group]
             test_1 = problem_figures[test_group[0]]
             test_2 = problem_figures[test_group[1]]
-            test_3 = problem_figures[test_group[2]]
 
-            if cls.is_operator(trans_1, trans_2, trans_3) and \
-                    cls.is_operator(test_1, test_2, test_3):
+            if cls.is_table_operator(table, trans_1, trans_2,
+                                     trans_group[2]) and \
+                    cls.is_table_operator(table, test_1, test_2,
+                                          test_group[2]):
                 return True
 
         return False
@@ -27,6 +33,15 @@ class LogicalOperator(Base):
         post_op = cls.do_operator(fig_1, fig_2)
         return cls.is_match(post_op, result)
 
+    @classmethod
+    def is_table_operator(cls, table, fig_1, fig_2, result_name):
+        """Same as is_operator with the result given as a named figure whose
+        statistics are read from the problem's SimilarityTable."""
+
+        post_op = cls.do_operator(fig_1, fig_2)
+        return Unchanged.is_stats_match(
+            table.match_stats_with(post_op, result_name))
+
     @staticmethod
     def is_match(fig_1, fig_2):
         return Unchanged.is_match(fig_1, fig_2)
@@ -35,6 +50,27 @@ class LogicalOperator(Base):
     def do_operator(fig_1, fig_2):
         raise NotImplementedError
 
+    @staticmethod
+    def do_row_operator(rows_1, rows_2):
+        """Same as do_operator, row by row, on figures laid out like
+        SimilarityTable.rows."""
+
+        raise NotImplementedError
+
+    @staticmethod
+    def block_bounds(blocks_1, blocks_2, block_size):
+        """Bounds on the black pixels of do_operator's result in each block,
+        given the black pixels of its operands there (see Pyramid; the whole
+        figure is one block of its own). These bounds hold for any operator;
+        subclasses narrow them.
+
+        Return:
+            (numpy.ndarray): Least possible black pixels in each block.
+            (numpy.ndarray): Most possible black pixels in each block.
+        """
+
+        return np.zeros_like(blocks_1), np.full_like(blocks_1, block_size)
+
     def __init__(self, problem_figures):
         self.problem_figures = problem_figures
 
@@ -43,21 +79,75 @@ class LogicalOperator(Base):
         return Unchanged.match_stats(fig_1, fig_2)
 
     def solve(self):
-        solutions = {Base.SKIP: Base.SKIP}
+        table = ProblemFigures.wrap(self.problem_figures).similarity_table
+        return Unchanged.pick_solution(*self.__class__.score_solutions(
+            table, table.rows, table.black_counts))
 
-        for app_group in Base.APP_GROUPS:
-            app_1 = self.problem_figures[app_group[0]]
-            app_2 = self.problem_figures[app_group[1]]
-            post_op = self.__class__.do_operator(app_1, app_2)
+    @classmethod
+    def solve_batch(cls, batch, indices):
+        if batch.thresholds is None:
+            stats = cls.score_solutions(batch, batch.rows[indices],
+                                        batch.black_counts[indices])
+        else:
+            stats = cls.prune_solutions(batch, indices)
+        return [Unchanged.pick_solution(*problem_stats)
+                for problem_stats in zip(*stats)]
 
-            for solution in Base.SOLUTION_FIGURE_KEYS:
-                solution_fig = self.problem_figures[solution]
+    @staticmethod
+    def solution_indices(figures):
+        """Figure indices of the solutions and of both operands of every app
+        group."""
 
-                match_stats = \
-                    self.__class__.match_stats(post_op, solution_fig)
+        return figures.get_indices(Base.SOLUTION_FIGURE_KEYS), \
+            figures.get_indices([app_group[0]
+                                 for app_group in Base.APP_GROUPS]), \
+            figures.get_indices([app_group[1]
+                                 for app_group in Base.APP_GROUPS])
 
-                if self.__class__.is_operator(app_1, app_2, solution_fig):
-                    avg_match = (match_stats[0] + match_stats[1]) / 2.0
-                    solutions[int(solution)] = avg_match
+    @classmethod
+    def score_solutions(cls, figures, rows, black_counts):
+        """Applies the operator to every app group at once and scores each
+        result against every solution.
+
+        Args:
+            figures (SimilarityTable): Figure indices, size and layout of
+                rows (a ProblemBatch works too).
+            rows (numpy.ndarray): Figures laid out like SimilarityTable.rows,
+                optionally with a leading problem axis.
+            black_counts (numpy.ndarray): Black pixels of every figure.
+
+        Return:
+            Same as Unchanged.score_solutions.
+        """
+
+        solutions_index, apps_1_index, apps_2_index = \
+            cls.solution_indices(figures)
+        post_ops = cls.do_row_operator(rows[..., apps_1_index, :],
+                                       rows[..., apps_2_index, :])
+        fractions, ratios = match_stats_rows(
+            post_ops, rows[..., solutions_index, :],
+            black_counts[..., solutions_index], figures.num_pixels,
+            figures.packed)
+        return Unchanged.are_stats_match(fractions, ratios), fractions, ratios
 
-        return max(solutions.iteritems(), key=operator.itemgetter(1))[0]
+    @classmethod
+    def prune_solutions(cls, batch, indices):
+        """Same as score_solutions for the problems of a pruned ProblemBatch
+        at indices: the statistics of answers that cannot match are upper
+        bounds (see Pruning.refine)."""
+
+        solutions_index, apps_1_index, apps_2_index = \
+            cls.solution_indices(batch)
+        # One comparison per problem, app group and solution.
+        shape = (len(indices), len(apps_1_index), len(solutions_index))
+        problems, apps, solutions = [
+            index.ravel() for index in np.indices(shape)]
+        problems = np.asarray(indices)[problems]
+        fractions, ratios, levels = refined_operator_stats(
+            cls.do_row_operator, cls.block_bounds, batch.rows,
+            batch.black_counts, batch.extents, batch.num_pixels, batch.packed,
+            batch.pyramids, batch.thresholds, problems, apps_1_index[apps],
+            apps_2_index[apps], solutions_index[solutions])
+        batch.count_stages(problems, levels)
+        fractions, ratios = fractions.reshape(shape), ratios.reshape(shape)
+        return Unchanged.are_stats_match(fractions, ratios), fractions, ratios
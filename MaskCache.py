@@ -0,0 +1,209 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from PackedMask import PackedMask
+
+# Every cache entry is one file: this header followed by the mask packed
+# eight pixels per byte. size and mtime are those of the source PNG when the
+# entry was written; an entry whose stamp no longer matches is stale.
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('pixels', '<u8'),
+    ('size', '<u8'),
+    ('mtime', '<u8')
+])
+MAGIC = b'RPMMASK1'
+
+
+class MaskCache:
+    """Persistent on-disk cache of decoded figure masks.
+
+    Masks are keyed by the absolute path of their PNG and stamped with the
+    file's size and modification time, so an edited figure is decoded again.
+    Hits are read through a memory map instead of decoding the PNG. Once the
+    cache grows past max_bytes the least recently used entries are evicted.
+
+    The cache is only an accelerator: when its directory cannot be created,
+    read or written (read-only or full disk, a bad path), masks are decoded
+    as if it were absent.
+    """
+
+    DEFAULT_DIRECTORY = '.mask_cache'
+    DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+    EXTENSION = '.mask'
+
+    @staticmethod
+    def from_environment():
+        """Builds the cache configured by the environment.
+
+        RAVENS_MASK_CACHE sets the cache directory, or bypasses the cache
+        when set to 0, off or false. RAVENS_MASK_CACHE_MAX_BYTES sets the
+        size cap; a value that is not a whole number of bytes is ignored.
+
+        Return:
+            (MaskCache): The cache, or None if it is bypassed.
+        """
+
+        directory = os.environ.get('RAVENS_MASK_CACHE',
+                                   MaskCache.DEFAULT_DIRECTORY)
+        if directory.lower() in ('', '0', 'off', 'false'):
+            return None
+        try:
+            max_bytes = int(os.environ.get('RAVENS_MASK_CACHE_MAX_BYTES',
+                                           MaskCache.DEFAULT_MAX_BYTES))
+        except ValueError:
+            max_bytes = MaskCache.DEFAULT_MAX_BYTES
+        return MaskCache(directory, max_bytes)
+
+    def __init__(self, directory=DEFAULT_DIRECTORY,
+                 max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.total_bytes = None
+        # Guards hits and misses, which threads sharing the cache bump.
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, decode, packed=False):
+        """Returns the mask of the PNG at path.
+
+        Args:
+            path (str): Path of the figure's PNG.
+            decode (callable): Called with no arguments on a miss; returns
+                the figure's mask as a flat array.
+            packed (bool): Return the mask as a PackedMask.
+
+        Return:
+            (numpy.ndarray): Flat np.int_ mask, 1 = black pixel, or the
+                PackedMask if packed is set.
+        """
+
+        stat = os.stat(path)
+        entry_path = self.__entry_path(path)
+        packed_mask = self.__load(entry_path, stat)
+        if packed_mask is not None:
+            with self.lock:
+                self.hits += 1
+            return packed_mask if packed else packed_mask.unpack()
+
+        with self.lock:
+            self.misses += 1
+        mask = decode()
+        packed_mask = PackedMask.pack(mask)
+        self.__store(entry_path, stat, packed_mask)
+        return packed_mask if packed else mask
+
+    def clear(self):
+        """Removes every cache entry."""
+
+        for entry_path, _stat in self.__entries():
+            os.remove(entry_path)
+        self.total_bytes = 0
+
+    def __entry_path(self, path):
+        key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key + MaskCache.EXTENSION)
+
+    @staticmethod
+    def __stamp(stat):
+        return stat.st_size, getattr(stat, 'st_mtime_ns',
+                                     int(stat.st_mtime * 1e9))
+
+    def __load(self, entry_path, stat):
+        try:
+            entry = np.memmap(entry_path, dtype=np.uint8, mode='r')
+        except (IOError, OSError, ValueError):
+            return None
+        if len(entry) < HEADER_DTYPE.itemsize:
+            return None
+
+        header = entry[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]
+        if header['magic'] != MAGIC or \
+                (header['size'], header['mtime']) != MaskCache.__stamp(stat):
+            return None
+
+        num_pixels = int(header['pixels'])
+        packed = entry[HEADER_DTYPE.itemsize:]
+        if len(packed) != (num_pixels + 7) // 8:
+            return None
+
+        # Touch the entry so eviction sees it as recently used.
+        try:
+            os.utime(entry_path, None)
+        except OSError:
+            pass  # Read-only cache: the hit still counts.
+        return PackedMask(np.array(packed), num_pixels)
+
+    def __store(self, entry_path, stat, packed_mask):
+        try:
+            self.__write(entry_path, stat, packed_mask)
+        except (IOError, OSError):
+            pass  # Unwritable cache: the mask was decoded all the same.
+
+    def __write(self, entry_path, stat, packed_mask):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header['magic'] = MAGIC
+        header['pixels'] = packed_mask.num_pixels
+        header['size'], header['mtime'] = MaskCache.__stamp(stat)
+
+        # Write to a temporary file and rename it so concurrent readers never
+        # see a partial entry.
+        fd, temp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as entry:
+                entry.write(header.tobytes())
+                entry.write(packed_mask.bits.tobytes())
+            previous_size = os.path.getsize(entry_path) \
+                if os.path.exists(entry_path) else 0
+            if os.name == 'nt' and previous_size:
+                os.remove(entry_path)
+            os.rename(temp_path, entry_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        if self.total_bytes is None:
+            self.total_bytes = sum(entry_stat.st_size
+                                   for _path, entry_stat in self.__entries())
+        else:
+            self.total_bytes += os.path.getsize(entry_path) - previous_size
+        if self.total_bytes > self.max_bytes:
+            self.__evict()
+
+    def __entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith(MaskCache.EXTENSION):
+                entry_path = os.path.join(self.directory, filename)
+                try:
+                    entries.append((entry_path, os.stat(entry_path)))
+                except OSError:
+                    pass  # Removed by another process.
+        return entries
+
+    def __evict(self):
+        """Removes least recently used entries until the cache is back under
+        three quarters of max_bytes."""
+
+        entries = sorted(self.__entries(),
+                         key=lambda entry: entry[1].st_mtime)
+        self.total_bytes = sum(stat.st_size for _path, stat in entries)
+        target_bytes = self.max_bytes * 3 // 4
+        for entry_path, stat in entries:
+            if self.total_bytes <= target_bytes:
+                break
+            try:
+                os.remove(entry_path)
+            except OSError:
+                pass
+            self.total_bytes -= stat.st_size
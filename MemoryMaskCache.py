@@ -0,0 +1,64 @@
+import collections
+import os
+import threading
+
+from PackedMask import PackedMask
+
+
+class MemoryMaskCache:
+    """In-memory cache of decoded figure masks for long running processes.
+
+    Masks are kept packed (PackedMask), keyed by the absolute path of their
+    PNG and stamped with the file's size and modification time like
+    MaskCache entries. Misses are read through an optional MaskCache.
+    Beyond max_entries masks the least recently used are dropped. The cache
+    can be shared by threads.
+    """
+
+    DEFAULT_MAX_ENTRIES = 4096
+
+    def __init__(self, backing=None, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        Args:
+            backing (MaskCache): Cache to read misses through, or None to
+                decode them.
+            max_entries (int): Most masks kept.
+        """
+
+        self.backing = backing
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, decode, packed=False):
+        """Same as MaskCache.get."""
+
+        stat = os.stat(path)
+        stamp = (stat.st_size, stat.st_mtime)
+        key = os.path.abspath(path)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None and entry[0] == stamp:
+                self.entries[key] = entry
+                self.hits += 1
+                packed_mask = entry[1]
+                return packed_mask if packed else packed_mask.unpack()
+            self.misses += 1
+
+        if self.backing is not None:
+            packed_mask = self.backing.get(path, decode, packed=True)
+        else:
+            packed_mask = PackedMask.pack(decode())
+        with self.lock:
+            self.entries[key] = (stamp, packed_mask)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return packed_mask if packed else packed_mask.unpack()
+
+    def clear(self):
+        """Drops every mask."""
+
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,87 @@
+import numpy as np
+
+# Number of set bits in every possible byte.
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount(bits, axis=None):
+    """Counts the set bits of a uint8 array, in total or along an axis."""
+
+    return POPCOUNT[bits].sum(axis=axis, dtype=np.int64)
+
+
+class PackedMask:
+    """A binary figure mask packed eight pixels per byte.
+
+    A 184x184 figure takes about 4 KB instead of the 270 KB of an np.int_
+    mask. Comparisons work on whole bytes: matching pixels are counted with
+    XOR and popcount, black pixels with popcount. The |, & and ^ operators
+    give the same pixels as Union, Intersection and Disjunction do on
+    unpacked masks.
+    """
+
+    @staticmethod
+    def pack(mask):
+        """Packs a flat mask (non-zero = black pixel)."""
+
+        return PackedMask(np.packbits(np.asarray(mask, dtype=np.bool_)),
+                          len(mask))
+
+    def __init__(self, bits, num_pixels):
+        """
+        Args:
+            bits (numpy.ndarray): uint8 array as returned by np.packbits.
+                Padding bits past num_pixels must be zero.
+            num_pixels (int): Number of pixels in the mask.
+        """
+
+        self.bits = bits
+        self.num_pixels = num_pixels
+        self.__black_count = None
+
+    def __len__(self):
+        return self.num_pixels
+
+    def __or__(self, other):
+        return PackedMask(self.bits | other.bits, self.num_pixels)
+
+    def __and__(self, other):
+        return PackedMask(self.bits & other.bits, self.num_pixels)
+
+    def __xor__(self, other):
+        return PackedMask(self.bits ^ other.bits, self.num_pixels)
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def unpack(self):
+        """Returns the mask as a flat np.int_ array."""
+
+        return np.int_(np.unpackbits(self.bits)[:self.num_pixels])
+
+    def black_count(self):
+        if self.__black_count is None:
+            self.__black_count = popcount(self.bits)
+        return self.__black_count
+
+    def match_count(self, other):
+        """Returns the number of pixels that are the same in both masks."""
+
+        return self.num_pixels - popcount(self.bits ^ other.bits)
+
+    def match_stats(self, other):
+        """Same as Unchanged.match_stats.
+
+        Return:
+            (float): Fraction of pixels that match.
+            (float): Ratio of the smaller to the larger black pixel count.
+        """
+
+        self_sum = self.black_count()
+        other_sum = other.black_count()
+        min_sum = min(self_sum, other_sum)
+        max_sum = max(self_sum, other_sum)
+
+        return float(self.match_count(other)) / float(self.num_pixels), \
+            float(min_sum) / float(max_sum)
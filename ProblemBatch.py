@@ -0,0 +1,187 @@
+import collections
+
+import numpy as np
+
+from Alignment import aligned_pairwise_stats
+from PackedMask import PackedMask
+from ProblemFigures import ProblemFigures
+from Pruning import EXACT, STAGES, refined_pairwise_stats
+from Pyramid import BLOCK_SIZES, Pyramid
+from SimilarityTable import SimilarityTable, count_black, pairwise_stats
+
+
+class ProblemBatch:
+    """The figures of several problems stacked into contiguous arrays.
+
+    rows is a (problems x figures x pixels) array laid out like
+    SimilarityTable.rows, with figures in names order, and the pairwise
+    statistics of every problem are computed over it in one pass. Every
+    problem's ProblemFigures is given a SimilarityTable that shares the
+    batch's arrays, so the problem classes see the same numbers either way.
+
+    All problems must have the same figure names, the same figure size and
+    the same mask layout (np.int_ arrays or PackedMask).
+
+    Given match thresholds, the batch is pruned: pairs of figures that
+    provably fail both thresholds, judging by the figures' summaries (and
+    with pyramids set, their Pyramids, stacked one array per level), only
+    get upper bounds on their match fractions. pair_levels records the stage
+    each pair was decided at (see Pruning.refine), and stage_counts counts
+    every problem's threshold comparisons by the stage that decided them,
+    including those the problem classes make on the batch later.
+
+    With align set, pairs of figures are compared at the offset where they
+    match best (see Alignment), recorded in pair_offsets. Aligned pairs are
+    never pruned; comparisons with operator results stay pixel aligned.
+    """
+
+    @staticmethod
+    def split(problems_figures, thresholds=None, pyramids=False,
+              align=False):
+        """Stacks problems into as few batches as their figures allow.
+
+        Args:
+            problems_figures (list): Figure masks of every problem.
+            thresholds (tuple): As for ProblemBatch.
+            pyramids (bool): As for ProblemBatch.
+            align (bool): As for ProblemBatch.
+
+        Return:
+            (list): (indices, batch) pairs, where indices are the positions
+                in problems_figures of the batch's problems, in order.
+        """
+
+        groups = collections.OrderedDict()
+        for i, problem_figures in enumerate(problems_figures):
+            names = sorted(problem_figures.iterkeys())
+            first = problem_figures[names[0]]
+            key = (tuple(names), len(first), isinstance(first, PackedMask))
+            groups.setdefault(key, []).append(i)
+        return [(indices,
+                 ProblemBatch([problems_figures[i] for i in indices],
+                              thresholds, pyramids, align))
+                for indices in groups.itervalues()]
+
+    def __init__(self, problems_figures, thresholds=None, pyramids=False,
+                 align=False):
+        """
+        Args:
+            problems_figures (list): Figure masks of every problem, each a
+                dict keyed by figure name.
+            thresholds (tuple): Match fraction and count ratio thresholds
+                (see Unchanged.is_stats_match) to prune comparisons against.
+            pyramids (bool): Also prune on the figures' Pyramids, coarse to
+                fine.
+            align (bool): Compare pairs of figures at their best offset.
+        """
+
+        self.problems_figures = [ProblemFigures.wrap(problem_figures)
+                                 for problem_figures in problems_figures]
+        self.names = sorted(self.problems_figures[0].iterkeys())
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+        first = self.problems_figures[0][self.names[0]]
+        self.packed = isinstance(first, PackedMask)
+        self.num_pixels = len(first)
+
+        row_length = len(first.bits) if self.packed else self.num_pixels
+        self.rows = np.empty(
+            (len(self.problems_figures), len(self.names), row_length),
+            dtype=np.uint8 if self.packed else np.bool_)
+        for i, problem_figures in enumerate(self.problems_figures):
+            if sorted(problem_figures.iterkeys()) != self.names:
+                raise ValueError('every problem in a batch must have the '
+                                 'figures %s' % ', '.join(self.names))
+            for j, name in enumerate(self.names):
+                figure = problem_figures[name]
+                if len(figure) != self.num_pixels:
+                    raise ValueError('every figure in a batch must have %d '
+                                     'pixels' % self.num_pixels)
+                if self.packed:
+                    self.rows[i, j] = figure.bits
+                else:
+                    np.not_equal(figure, 0, out=self.rows[i, j])
+
+        self.black_counts = count_black(self.rows, self.packed, axis=-1)
+        self.thresholds = thresholds
+        self.pyramids = self.__stack_pyramids() if pyramids else None
+        self.pair_offsets = None
+        if thresholds is None:
+            self.extents = None
+            self.pair_levels = None
+            self.stage_counts = None
+        else:
+            self.extents = np.array([
+                [problem_figures.summaries[name].black_extent
+                 for name in self.names]
+                for problem_figures in self.problems_figures], dtype=np.int64)
+        if align:
+            self.match_fractions, self.count_ratios, self.pair_offsets = \
+                aligned_pairwise_stats(self.rows, self.black_counts,
+                                       self.num_pixels, self.packed)
+            if thresholds is not None:
+                self.pair_levels = np.full(self.match_fractions.shape, EXACT,
+                                           dtype=np.int64)
+        elif thresholds is None:
+            self.match_fractions, self.count_ratios = pairwise_stats(
+                self.rows, self.black_counts, self.num_pixels, self.packed)
+        else:
+            self.match_fractions, self.count_ratios, self.pair_levels = \
+                refined_pairwise_stats(self.rows, self.black_counts,
+                                       self.extents, self.num_pixels,
+                                       self.packed, self.pyramids, thresholds)
+        if thresholds is not None:
+            self.stage_counts = np.zeros((len(self), EXACT + 1),
+                                         dtype=np.int64)
+            pairs_i, pairs_j = np.triu_indices(len(self.names), 1)
+            self.count_stages(
+                np.repeat(np.arange(len(self)), len(pairs_i)),
+                self.pair_levels[:, pairs_i, pairs_j].ravel())
+
+        for i, problem_figures in enumerate(self.problems_figures):
+            problem_figures.similarity_table = SimilarityTable(
+                problem_figures, self, i)
+
+    def __stack_pyramids(self):
+        pyramids = []
+        for problem_figures in self.problems_figures:
+            problem_pyramids = []
+            for name in self.names:
+                pyramid = problem_figures.summaries[name].pyramid
+                if pyramid is None:
+                    pyramid = Pyramid.of(problem_figures[name])
+                problem_pyramids.append(pyramid.levels)
+            pyramids.append(problem_pyramids)
+        # (problems x figures x blocks) for every level.
+        return [np.array([[levels[level] for levels in problem_pyramids]
+                          for problem_pyramids in pyramids])
+                for level in range(len(BLOCK_SIZES))]
+
+    def count_stages(self, problems, levels):
+        """Adds threshold comparisons to stage_counts.
+
+        Args:
+            problems (numpy.ndarray): Problem index of every comparison.
+            levels (numpy.ndarray): Stage every comparison was decided at,
+                as returned by Pruning.refine.
+        """
+
+        np.add.at(self.stage_counts, (problems, levels), 1)
+
+    def comparisons_by_stage(self, i):
+        """Threshold comparisons of problem i, keyed by the name of the
+        Pruning.STAGES stage that rejected them or 'exact'."""
+
+        return dict(zip(STAGES + ['exact'], self.stage_counts[i].tolist()))
+
+    def __len__(self):
+        return len(self.problems_figures)
+
+    def count_black(self, rows, axis=None):
+        """Counts the black pixels of rows laid out like self.rows."""
+
+        return count_black(rows, self.packed, axis)
+
+    def get_indices(self, names):
+        """Returns the figure indices of the named figures."""
+
+        return np.array([self.index[name] for name in names])
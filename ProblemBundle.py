@@ -0,0 +1,266 @@
+import collections
+import io
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+from PIL import Image
+
+from ImageUtils import ImageUtils
+from PackedMask import PackedMask
+from ProblemSet import ProblemSet
+from RavensFigure import RavensFigure
+from RavensObject import RavensObject
+from RavensProblem import RavensProblem
+
+# A bundle is one file: this header, then the data blocks (every figure's
+# packed mask and PNG file, each starting on an ALIGNMENT byte boundary),
+# then a JSON index of the sets, problems and figures with the offset and
+# length of every data block.
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('index_offset', '<u8'),
+    ('index_length', '<u8')
+])
+MAGIC = b'RPMBNDL1'
+ALIGNMENT = 8
+
+
+class ProblemBundle:
+    """Problem sets compiled into a single file and read through a memory
+    map.
+
+    A bundle holds, for every problem, its metadata (the same fields
+    ProblemSet parses from ProblemData.txt), its answer and, for every
+    figure, the figure's mask packed eight pixels per byte and the figure's
+    PNG file. Opening a bundle is a single file open; problems, masks and
+    images are then read out of the memory map.
+
+    Figures are keyed by the visualFilename RavensFigure gives them, so a
+    bundle serves as the mask source of a FigureStore in place of a
+    MaskCache, for problems loaded from the bundle or from the Problems
+    directory alike.
+    """
+
+    DEFAULT_PATH = 'Problems.bundle'
+
+    @staticmethod
+    def compile(path, set_names=None):
+        """Compiles problem sets into a bundle.
+
+        Args:
+            path (str): Path of the bundle to write. An existing bundle is
+                replaced once the new one is complete.
+            set_names (list): Names of the sets to compile, from the
+                Problems directory. Defaults to the sets listed in
+                ProblemSetList.txt.
+
+        Return:
+            (int): Number of problems compiled.
+        """
+
+        if set_names is None:
+            with open(os.path.join('Problems', 'ProblemSetList.txt')) as r:
+                set_names = [line.rstrip() for line in r if line.rstrip()]
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as bundle:
+                bundle.write(np.zeros(1, dtype=HEADER_DTYPE).tobytes())
+                sets = [ProblemBundle.__compile_set(bundle, set_name)
+                        for set_name in set_names]
+
+                header = np.zeros(1, dtype=HEADER_DTYPE)
+                header['magic'] = MAGIC
+                header['index_offset'] = bundle.tell()
+                index = json.dumps(dict(sets=sets), sort_keys=True)
+                bundle.write(index.encode('utf-8'))
+                header['index_length'] = bundle.tell() - \
+                    header['index_offset']
+                bundle.seek(0)
+                bundle.write(header.tobytes())
+            if os.name == 'nt' and os.path.exists(path):
+                os.remove(path)
+            os.rename(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return sum(len(problem_set['problems']) for problem_set in sets)
+
+    @staticmethod
+    def __compile_set(bundle, set_name):
+        problems = []
+        for problem in ProblemSet(set_name, lazy=True).iterProblems():
+            problem_dir = os.path.join('Problems', set_name, problem.name)
+            answer_path = os.path.join(problem_dir, 'ProblemAnswer.txt')
+            answer = None
+            if os.path.isfile(answer_path):
+                with open(answer_path) as r:
+                    answer = int(r.readline().rstrip())
+
+            figures = []
+            for name in sorted(problem.figures.iterkeys()):
+                figure = problem.figures[name]
+                entry = dict(name=name, objects=dict(
+                    (object_name, ravens_object.attributes)
+                    for object_name, ravens_object in
+                    figure.objects.iteritems()))
+                if os.path.isfile(figure.visualFilename):
+                    with open(figure.visualFilename, 'rb') as r:
+                        png = r.read()
+                    image = Image.open(io.BytesIO(png))
+                    mask = PackedMask.pack(ImageUtils.get_image_data(image))
+                    entry['pixels'] = mask.num_pixels
+                    entry['mask'] = ProblemBundle.__write_block(
+                        bundle, mask.bits.tobytes())
+                    entry['png'] = ProblemBundle.__write_block(bundle, png)
+                figures.append(entry)
+
+            problems.append(dict(
+                name=problem.name, problemType=problem.problemType,
+                hasVisual=problem.hasVisual, hasVerbal=problem.hasVerbal,
+                answer=answer, figures=figures))
+        return dict(name=set_name, problems=problems)
+
+    @staticmethod
+    def __write_block(bundle, data):
+        """Writes a data block and returns its (offset, length)."""
+
+        bundle.write(b'\0' * (-bundle.tell() % ALIGNMENT))
+        offset = bundle.tell()
+        bundle.write(data)
+        return offset, len(data)
+
+    def __init__(self, path=DEFAULT_PATH):
+        """
+        Args:
+            path (str): Path of a bundle written by compile.
+        """
+
+        self.path = path
+        # Guards hits and misses, which threads sharing the bundle bump.
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        if len(self.data) < HEADER_DTYPE.itemsize:
+            raise ValueError('%s is not a problem bundle' % path)
+        header = self.data[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]
+        if header['magic'] != MAGIC:
+            raise ValueError('%s is not a problem bundle' % path)
+        index_offset = int(header['index_offset'])
+        index = json.loads(self.data[
+            index_offset:index_offset + int(header['index_length'])
+        ].tobytes().decode('utf-8'))
+
+        # Problem entries keyed by set name, then by problem name in
+        # ProblemList.txt order.
+        self.sets = []
+        self.problems = {}
+        # Figure entries keyed by the normalized visualFilename.
+        self.figures = {}
+        for problem_set in index['sets']:
+            set_name = problem_set['name']
+            self.sets.append(set_name)
+            problems = self.problems.setdefault(set_name,
+                                                collections.OrderedDict())
+            for problem in problem_set['problems']:
+                problems[problem['name']] = problem
+                for figure in problem['figures']:
+                    visual_filename = RavensFigure(
+                        figure['name'], problem['name'],
+                        set_name).visualFilename
+                    self.figures[os.path.normpath(visual_filename)] = figure
+
+    def problem_set(self, set_name, lazy=False):
+        """Returns a set of the bundle as a ProblemSet (see
+        BundledProblemSet)."""
+
+        return BundledProblemSet(self, set_name, lazy)
+
+    def problem_sets(self, lazy=False):
+        """Returns every set of the bundle, in the order they were
+        compiled."""
+
+        return [self.problem_set(set_name, lazy) for set_name in self.sets]
+
+    def problem_names(self, set_name):
+        """Returns the names of a set's problems, in ProblemList.txt
+        order."""
+
+        return list(self.problems[set_name].iterkeys())
+
+    def get_problem(self, set_name, problem_name):
+        """Builds the RavensProblem ProblemSet would parse from the Problems
+        directory."""
+
+        entry = self.problems[set_name][problem_name]
+        problem = RavensProblem(problem_name, entry['problemType'], set_name,
+                                entry['hasVisual'], entry['hasVerbal'])
+        for figure_entry in entry['figures']:
+            figure = RavensFigure(figure_entry['name'], problem_name,
+                                  set_name)
+            for object_name, attributes in \
+                    figure_entry['objects'].iteritems():
+                ravens_object = RavensObject(object_name)
+                ravens_object.attributes.update(attributes)
+                figure.objects[object_name] = ravens_object
+            problem.figures[figure.name] = figure
+        return problem
+
+    def answer(self, set_name, problem_name):
+        """Returns the correct answer to a problem, or None if the problem
+        had no ProblemAnswer.txt."""
+
+        return self.problems[set_name][problem_name]['answer']
+
+    def get(self, path, decode, packed=False):
+        """Same as MaskCache.get: returns the mask of the figure at path,
+        from the bundle or, for figures it lacks, from decode.
+
+        Masks are served straight out of the memory map. hits and misses
+        count the figures served from the bundle and decoded.
+        """
+
+        figure = self.figures.get(os.path.normpath(path))
+        if figure is None or 'mask' not in figure:
+            with self.lock:
+                self.misses += 1
+            mask = decode()
+            return PackedMask.pack(mask) if packed else mask
+        with self.lock:
+            self.hits += 1
+        packed_mask = PackedMask(self.__block(figure['mask']),
+                                 figure['pixels'])
+        return packed_mask if packed else packed_mask.unpack()
+
+    def open_image(self, path):
+        """Opens the PNG of the figure at path from the bundle, or returns
+        None for figures it lacks."""
+
+        figure = self.figures.get(os.path.normpath(path))
+        if figure is None or 'png' not in figure:
+            return None
+        return Image.open(io.BytesIO(self.__block(figure['png']).tobytes()))
+
+    def __block(self, block):
+        offset, length = block
+        return self.data[offset:offset + length]
+
+
+class BundledProblemSet(ProblemSet):
+    """A ProblemSet whose problems are read from a ProblemBundle instead of
+    the Problems directory."""
+
+    def __init__(self, bundle, name, lazy=False):
+        self.bundle = bundle
+        ProblemSet.__init__(self, name, lazy)
+
+    def getProblemNames(self):
+        return self.bundle.problem_names(self.name)
+
+    def parseProblem(self, problemName):
+        return self.bundle.get_problem(self.name, problemName)
@@ -0,0 +1,54 @@
+from FigureSummary import FigureSummary
+from SimilarityTable import SimilarityTable
+
+
+class ProblemFigures(dict):
+    """Dictionary of a problem's figure masks, keyed by figure name.
+
+    Besides the masks it carries the per-problem tables derived from them,
+    built on first use and shared by every problem class that looks at the
+    same problem, and a FigureSummary of every figure. The summaries are
+    passed in when the masks are decoded (see FigureStore) and computed on
+    first use otherwise.
+    """
+
+    @staticmethod
+    def wrap(problem_figures):
+        """Returns problem_figures as ProblemFigures. Plain dictionaries are
+        wrapped, so their derived tables are not kept between calls."""
+
+        if isinstance(problem_figures, ProblemFigures):
+            return problem_figures
+        return ProblemFigures(problem_figures)
+
+    def __init__(self, *args, **kwargs):
+        summaries = kwargs.pop('summaries', None)
+        dict.__init__(self, *args, **kwargs)
+        self.__summaries = summaries
+        self.__similarity_table = None
+
+    @property
+    def summaries(self):
+        """FigureSummary of every figure, keyed by figure name."""
+
+        if self.__summaries is None:
+            self.__summaries = dict((name, FigureSummary.of(mask))
+                                    for name, mask in self.iteritems())
+        return self.__summaries
+
+    def black_count(self, name):
+        """Returns the number of black pixels in the named figure."""
+
+        return self.summaries[name].black_count
+
+    @property
+    def similarity_table(self):
+        if self.__similarity_table is None:
+            self.__similarity_table = SimilarityTable(self)
+        return self.__similarity_table
+
+    @similarity_table.setter
+    def similarity_table(self, similarity_table):
+        """Installs a table computed elsewhere, e.g. by a ProblemBatch."""
+
+        self.__similarity_table = similarity_table
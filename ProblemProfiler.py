@@ -0,0 +1,66 @@
+import cProfile
+import fnmatch
+import os
+
+from SolveTimings import clock
+
+
+class ProblemProfiler:
+    """Profiles individual Agent.Solve calls with cProfile.
+
+    Problems are selected by a shell-style pattern on their name, by a
+    latency threshold, or both. With a threshold every selected call is
+    profiled, but a profile is only kept if the call took at least that
+    long. Each kept profile is written to <directory>/<problem name>.prof in
+    the pstats format, which pstats, snakeviz, gprof2dot and flameprof read.
+    """
+
+    DEFAULT_DIRECTORY = 'profiles'
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, pattern=None,
+                 threshold=None):
+        """
+        Args:
+            directory (str): Where to write the profiles.
+            pattern (str): Only profile problems whose name matches this
+                fnmatch pattern, e.g. 'Basic Problem E-*'. All problems if
+                None.
+            threshold (float): Only keep profiles of calls that took at least
+                this many seconds. Keep all if None.
+        """
+
+        self.directory = directory
+        self.pattern = pattern
+        self.threshold = threshold
+        # Names of the problems whose profiles were written.
+        self.profiled = []
+
+    def selects(self, problem):
+        return self.pattern is None or \
+            fnmatch.fnmatchcase(problem.name, self.pattern)
+
+    def profile_path(self, problem):
+        filename = problem.name.replace(os.sep, '_') + '.prof'
+        return os.path.join(self.directory, filename)
+
+    def run(self, problem, solve, *args):
+        """Calls solve(*args), profiling it if the problem is selected.
+
+        Return:
+            The return value of solve.
+        """
+
+        if not self.selects(problem):
+            return solve(*args)
+
+        profile = cProfile.Profile()
+        start = clock()
+        try:
+            return profile.runcall(solve, *args)
+        finally:
+            elapsed = clock() - start
+            if self.threshold is None or elapsed >= self.threshold:
+                if not os.path.isdir(self.directory):
+                    os.makedirs(self.directory)
+                profile.dump_stats(self.profile_path(problem))
+                self.profiled.append(problem.name)
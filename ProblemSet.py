@@ -23,27 +23,65 @@ class ProblemSet:
     # Your agent does not need to use this method.
     #
     # @param name The name of the problem set.
-    def __init__(self,name):
+    # @param lazy If true, no problem is loaded up front. iterProblems() then
+    #             streams the problems one at a time, and the problems list
+    #             is only loaded if it is accessed.
+    def __init__(self,name,lazy=False):
         # The name of the problem set.
         self.name=name
 
-        # A list of the problems in the problem set.
-        self.problems=[]
+        if not lazy:
+            # A list of the problems in the problem set.
+            self.problems=[]
 
-        self.loadProblemSet()
+            self.loadProblemSet()
+
+    # Loads the problems list on first access when the set is lazy. If
+    # loading fails, the partial list is dropped so the next access raises
+    # again.
+    def __getattr__(self, attr):
+        if attr=="problems":
+            self.problems=[]
+            try:
+                self.loadProblemSet()
+            except:
+                del self.problems
+                raise
+            return self.problems
+        raise AttributeError(attr)
 
     # Loads the problem set from the folder whose name matches that of this
     # problem set.
     #
     # Your agent does not need to use this method.
     def loadProblemSet(self):
-        r = open("Problems" + os.sep + self.name + os.sep + "ProblemList.txt")
-        line = self.getNextLine(r)
-        while not line=="":
-            self.loadProblem(line)
-            line=self.getNextLine(r)
+        for problemName in self.getProblemNames():
+            self.loadProblem(problemName)
+
+    # Yields the problems of this set in order. If the problems list has not
+    # been loaded, each problem is parsed only when it is reached and is not
+    # kept by the set.
+    def iterProblems(self):
+        if "problems" in self.__dict__:
+            for problem in self.problems:
+                yield problem
+        else:
+            for problemName in self.getProblemNames():
+                yield self.parseProblem(problemName)
+
+    # Yields the names of the problems listed in the set's ProblemList.txt.
+    def getProblemNames(self):
+        with open("Problems" + os.sep + self.name + os.sep + "ProblemList.txt") as r:
+            line = self.getNextLine(r)
+            while not line=="":
+                yield line
+                line=self.getNextLine(r)
 
     def loadProblem(self, problemName):
+        self.problems.append(self.parseProblem(problemName))
+
+    # Parses and returns a single problem of this set.
+    def parseProblem(self, problemName):
         data_filename = "Problems" + os.sep + self.name + os.sep + problemName + os.sep + "ProblemData.txt"
 
         with open(data_filename) as r:
@@ -94,7 +132,7 @@ class ProblemSet:
                     newProblem.figures["H"]=RavensFigure("H", problemName, self.name)
                     newProblem.figures["7"]=RavensFigure("7", problemName, self.name)
                     newProblem.figures["8"]=RavensFigure("8", problemName, self.name)
-            self.problems.append(newProblem)
+            return newProblem
 
     # Returns the total number of problems answered in this set in a certain
     # type.
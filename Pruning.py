@@ -0,0 +1,236 @@
+import numpy as np
+
+from Pyramid import BLOCK_SIZES, interval_mismatch_bound, mismatch_bound, \
+    ratio_bound
+from SimilarityTable import count_black, pairwise_count_ratios
+
+# Stages at which a comparison can be rejected, cheapest first: the figures'
+# summaries (black counts and extents, see FigureSummary), then every
+# Pyramid level.
+STAGES = ['summary'] + ['pyramid %d' % size for size in BLOCK_SIZES]
+# Stage of the comparisons that were computed at full resolution.
+EXACT = len(STAGES)
+
+
+def extent_overlap(extents_1, extents_2):
+    """Number of pixels in both of two black extents, (first, last) pairs
+    along the last axis."""
+
+    return np.maximum(np.minimum(extents_1[..., 1], extents_2[..., 1]) -
+                      np.maximum(extents_1[..., 0], extents_2[..., 0]) + 1, 0)
+
+
+def extent_hull(extents_1, extents_2):
+    """Smallest extent holding both of two black extents."""
+
+    return np.stack([np.minimum(extents_1[..., 0], extents_2[..., 0]),
+                     np.maximum(extents_1[..., 1], extents_2[..., 1])],
+                    axis=-1)
+
+
+def summary_mismatch_bound(count_low, count_high, extents, counts, extents_2):
+    """Lower bound on the number of pixels in which figures differ, from
+    their summaries alone.
+
+    The first figures have between count_low and count_high black pixels,
+    all within extents; the second have counts black pixels within
+    extents_2. Black pixels can only match inside the overlap of the
+    extents, and every black pixel that does not match is a mismatch.
+    """
+
+    most_shared = np.minimum(counts, extent_overlap(extents, extents_2))
+    # The mismatches c + counts - 2 * min(c, most_shared) are least for the
+    # count c closest to most_shared.
+    closest = np.clip(most_shared, count_low, count_high)
+    return closest + counts - 2 * np.minimum(closest, most_shared)
+
+
+def refine(num_comparisons, num_pixels, thresholds, stages, bounds, exact):
+    """Decides comparisons against the match thresholds, cheapest bounds
+    first.
+
+    A comparison is rejected at the first stage whose bounds show it cannot
+    reach either threshold (Unchanged.is_stats_match would be False whatever
+    the pixels); only the rest are computed at full resolution.
+
+    Args:
+        num_comparisons (int): Number of comparisons.
+        num_pixels (int): Number of pixels in every figure.
+        thresholds (tuple): Match fraction and count ratio thresholds.
+        stages (list): Indices into STAGES of the stages to try, in order.
+        bounds (callable): Called with a stage index and the indices of the
+            comparisons still undecided; returns lower bounds on their
+            mismatching pixels and upper bounds on their count ratios.
+        exact (callable): Called with the indices of the comparisons left
+            after the last stage; returns their match fractions and count
+            ratios.
+
+    Return:
+        (numpy.ndarray): Match fractions: exact, or upper bounds for
+            rejected comparisons.
+        (numpy.ndarray): Count ratios, likewise.
+        (numpy.ndarray): The stage each comparison was rejected at, or EXACT
+            if it was computed at full resolution.
+    """
+
+    fractions = np.empty(num_comparisons)
+    ratios = np.empty(num_comparisons)
+    levels = np.full(num_comparisons, EXACT, dtype=np.int64)
+
+    undecided = np.arange(num_comparisons)
+    for stage in stages:
+        if not len(undecided):
+            break
+        mismatches, ratio_bounds = bounds(stage, undecided)
+        fraction_bounds = (num_pixels - mismatches) / float(num_pixels)
+        # NaN ratio bounds (two blank figures) compare False and are kept.
+        with np.errstate(invalid='ignore'):
+            rejected = (fraction_bounds < thresholds[0]) & \
+                (ratio_bounds < thresholds[1])
+        fractions[undecided[rejected]] = fraction_bounds[rejected]
+        ratios[undecided[rejected]] = ratio_bounds[rejected]
+        levels[undecided[rejected]] = stage
+        undecided = undecided[~rejected]
+
+    if len(undecided):
+        fractions[undecided], ratios[undecided] = exact(undecided)
+    return fractions, ratios, levels
+
+
+def refined_pairwise_stats(rows, black_counts, extents, num_pixels, packed,
+                           pyramids, thresholds):
+    """Same as SimilarityTable.pairwise_stats, pruned: pairs that cannot
+    match are only bounded.
+
+    Args:
+        rows (numpy.ndarray): Figures laid out like SimilarityTable.rows,
+            with a leading problem axis.
+        black_counts (numpy.ndarray): Black pixels of every figure.
+        extents (numpy.ndarray): Black extent of every figure (see
+            FigureSummary), with (first, last) as last axis.
+        num_pixels (int): Number of pixels in every figure.
+        packed (bool): Whether rows holds packed bits.
+        pyramids (list): Pyramid levels of every figure, each shaped like
+            rows with the blocks as last axis, or None to prune on the
+            summaries only.
+        thresholds (tuple): Match fraction and count ratio thresholds.
+
+    Return:
+        (numpy.ndarray): Match fractions, upper bounds for pairs that fail
+            both thresholds.
+        (numpy.ndarray): Count ratios, always exact.
+        (numpy.ndarray): The stage each pair was decided at, as for refine.
+    """
+
+    num_problems, num_figures = rows.shape[:2]
+    counts = black_counts.astype(np.int64)
+    count_ratios = pairwise_count_ratios(black_counts)
+
+    # Every pair once: problem p, figures i < j.
+    pairs_i, pairs_j = np.triu_indices(num_figures, 1)
+    problems = np.repeat(np.arange(num_problems), len(pairs_i))
+    pairs_i = np.tile(pairs_i, num_problems)
+    pairs_j = np.tile(pairs_j, num_problems)
+    pair_ratios = count_ratios[problems, pairs_i, pairs_j]
+
+    def bounds(stage, indices):
+        p, i, j = problems[indices], pairs_i[indices], pairs_j[indices]
+        if stage == 0:
+            mismatches = summary_mismatch_bound(
+                counts[p, i], counts[p, i], extents[p, i], counts[p, j],
+                extents[p, j])
+        else:
+            level = pyramids[stage - 1]
+            mismatches = mismatch_bound(level[p, i], level[p, j])
+        return mismatches, pair_ratios[indices]
+
+    def exact(indices):
+        p, i, j = problems[indices], pairs_i[indices], pairs_j[indices]
+        mismatches = count_black(rows[p, i] ^ rows[p, j], packed, axis=-1)
+        return (num_pixels - mismatches) / float(num_pixels), \
+            pair_ratios[indices]
+
+    fractions, _ratios, levels = refine(
+        len(problems), num_pixels, thresholds, stages_for(pyramids), bounds,
+        exact)
+
+    match_fractions = np.ones((num_problems, num_figures, num_figures))
+    match_fractions[problems, pairs_i, pairs_j] = fractions
+    match_fractions[problems, pairs_j, pairs_i] = fractions
+    pair_levels = np.full(match_fractions.shape, EXACT, dtype=np.int64)
+    pair_levels[problems, pairs_i, pairs_j] = levels
+    pair_levels[problems, pairs_j, pairs_i] = levels
+    return match_fractions, count_ratios, pair_levels
+
+
+def refined_operator_stats(row_operator, block_bounds, rows, black_counts,
+                           extents, num_pixels, packed, pyramids, thresholds,
+                           problems, operands_1, operands_2, results):
+    """Match statistics between operator results and figures, pruned:
+    comparisons that cannot match are only bounded, and the operator is only
+    applied at full resolution for the rest.
+
+    Comparison k compares row_operator(rows[p, operands_1[k]],
+    rows[p, operands_2[k]]) with rows[p, results[k]], where p is
+    problems[k]. The operator's black pixels lie within the hull of its
+    operands' extents.
+
+    Args:
+        row_operator (callable): A LogicalOperator's do_row_operator.
+        block_bounds (callable): The same LogicalOperator's block_bounds.
+        rows, black_counts, extents, num_pixels, packed, pyramids,
+            thresholds: As for refined_pairwise_stats.
+        problems, operands_1, operands_2, results (numpy.ndarray): Problem
+            and figure indices of every comparison.
+
+    Return:
+        Same as refine.
+    """
+
+    counts = black_counts.astype(np.int64)
+    result_counts = counts[problems, results]
+
+    def bounds(stage, indices):
+        p = problems[indices]
+        operand_1, operand_2 = operands_1[indices], operands_2[indices]
+        if stage == 0:
+            # The whole figure as a single block.
+            low, high = block_bounds(counts[p, operand_1],
+                                     counts[p, operand_2], num_pixels)
+            mismatches = summary_mismatch_bound(
+                low, high,
+                extent_hull(extents[p, operand_1], extents[p, operand_2]),
+                result_counts[indices], extents[p, results[indices]])
+        else:
+            level = pyramids[stage - 1]
+            low, high = block_bounds(level[p, operand_1], level[p, operand_2],
+                                     BLOCK_SIZES[stage - 1])
+            mismatches = interval_mismatch_bound(low, high,
+                                                 level[p, results[indices]])
+            low = low.sum(axis=-1, dtype=np.int64)
+            high = high.sum(axis=-1, dtype=np.int64)
+        return mismatches, ratio_bound(low, high, result_counts[indices])
+
+    def exact(indices):
+        p = problems[indices]
+        post_op = row_operator(rows[p, operands_1[indices]],
+                               rows[p, operands_2[indices]])
+        mismatches = count_black(post_op ^ rows[p, results[indices]], packed,
+                                 axis=-1)
+        post_op_counts = count_black(post_op, packed, axis=-1).astype(
+            np.int64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratios = \
+                np.minimum(post_op_counts, result_counts[indices]) / \
+                np.maximum(post_op_counts, result_counts[indices]).astype(
+                    np.float64)
+        return (num_pixels - mismatches) / float(num_pixels), ratios
+
+    return refine(len(problems), num_pixels, thresholds, stages_for(pyramids),
+                  bounds, exact)
+
+
+def stages_for(pyramids):
+    """The stages refine can try with or without Pyramid levels."""
+
+    return range(EXACT if pyramids is not None else 1)
@@ -0,0 +1,85 @@
+import numpy as np
+
+from PackedMask import POPCOUNT, PackedMask
+
+# Pixels per block at each pyramid level, coarse to fine. Both are multiples
+# of 8, so a PackedMask's bytes are whole parts of a block.
+BLOCK_SIZES = [256, 16]
+
+
+class Pyramid:
+    """Black pixel counts of a figure mask over blocks of pixels, at the
+    resolutions of BLOCK_SIZES.
+
+    Blocks are runs of consecutive pixels of the flat mask; the last block is
+    padded with white pixels. For two figures, the differences of their block
+    counts summed over a level are a lower bound on the number of pixels in
+    which they differ, since a block whose counts differ by d has at least d
+    mismatching pixels. The bound tightens with every finer level, so a
+    comparison against a threshold can often be decided without looking at
+    the pixels at all (see Pruning).
+    """
+
+    @staticmethod
+    def of(mask):
+        """Builds the pyramid of a flat binary mask or a PackedMask."""
+
+        if isinstance(mask, PackedMask):
+            counts = POPCOUNT[mask.bits]
+            pixels_per_count = 8
+        else:
+            counts = np.asarray(mask) != 0
+            pixels_per_count = 1
+
+        num_blocks = -(-len(counts) * pixels_per_count // BLOCK_SIZES[0])
+        padded_length = num_blocks * BLOCK_SIZES[0] // pixels_per_count
+        counts = np.concatenate([
+            counts, np.zeros(padded_length - len(counts), dtype=counts.dtype)])
+
+        # Sum the finest level from the counts and every coarser level from
+        # the level below it.
+        levels = [counts.reshape(-1, BLOCK_SIZES[-1] // pixels_per_count).sum(
+            axis=1, dtype=np.int32)]
+        for finer_size, size in zip(BLOCK_SIZES[:0:-1], BLOCK_SIZES[-2::-1]):
+            levels.insert(0, levels[0].reshape(-1, size // finer_size).sum(
+                axis=1, dtype=np.int32))
+        return Pyramid(levels)
+
+    def __init__(self, levels):
+        """
+        Args:
+            levels (list): Block counts at each of BLOCK_SIZES, as int32
+                arrays.
+        """
+
+        self.levels = levels
+
+
+def mismatch_bound(level_1, level_2):
+    """Lower bound on the number of pixels in which figures differ, from
+    their block counts at one level (with any leading axes)."""
+
+    return np.abs(level_1 - level_2).sum(axis=-1, dtype=np.int64)
+
+
+def interval_mismatch_bound(low, high, level):
+    """Lower bound on the number of pixels in which figures whose block
+    counts are only known to lie within [low, high] differ from figures with
+    the block counts level."""
+
+    return (np.maximum(low - level, 0) +
+            np.maximum(level - high, 0)).sum(axis=-1, dtype=np.int64)
+
+
+def ratio_bound(count_low, count_high, counts):
+    """Upper bound on the count ratio between figures with between
+    count_low and count_high black pixels and figures with counts black
+    pixels."""
+
+    count_low = count_low.astype(np.float64)
+    count_high = count_high.astype(np.float64)
+    counts = counts.astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(counts < count_low, counts / count_low,
+                        np.where(counts > count_high, count_high / counts,
+                                 1.0))
@@ -11,33 +11,97 @@
 import os
 import sys
 import csv
+import argparse
+import multiprocessing
 
 from Agent import Agent
+from ProblemBundle import ProblemBundle
 from ProblemSet import ProblemSet
 from RavensGrader import grade
+from SolvePipeline import SolvePipeline
+from SolveTimings import SolveTimingsWriter
+from StreamingGrader import StreamingGrader
+from ProblemProfiler import ProblemProfiler
 
 def getNextLine(r):
     return r.readline().rstrip()
 
+# The Agent of a worker process, created once per worker by initWorker.
+workerAgent=None
+
+def initWorker(profiler=None, bundlePath=None):
+    global workerAgent
+    bundle=ProblemBundle(bundlePath) if bundlePath else None
+    workerAgent=Agent(profiler=profiler, bundle=bundle)
+
+# Solves one problem in a worker process. Returns the answer together with
+# the names of its set and problem and the stage timings of the solve.
+def solveInWorker(job):
+    setName, problem = job
+    answer = workerAgent.Solve(problem)
+    return setName, problem.name, answer, workerAgent.timings
+
 # The project's main solve method. This will generate your agent's answers
 # to all the current problems.
 #
+# With workers greater than 1, problems are spread across that many worker
+# processes, each with its own Agent. Answers are still written in the
+# order of the problem sets and problems.
+#
+# With readAhead greater than 0, loading, solving and writing run as a
+# pipeline and up to readAhead problems are decoded ahead of the one being
+# solved (see SolvePipeline).
+#
+# With timings set, the stage timings of every problem are written to
+# AgentTimings.csv (see SolveTimings).
+#
+# A ProblemProfiler given as profiler profiles the Solve calls it selects.
+#
+# With bundlePath set, the sets compiled into that ProblemBundle are solved
+# instead, reading problems and figures from the bundle alone (see
+# bundle.py).
+#
+# A StreamingGrader given as grader grades every answer as soon as it is
+# written to AgentAnswers.csv.
+#
 # You do not need to use this method.
-def solve():
+def solve(workers=1, readAhead=0, timings=False, profiler=None, bundlePath=None, grader=None):
     sets=[] # The variable 'sets' stores multiple problem sets.
             # Each problem set comes from a different folder in /Problems/
             # Additional sets of problems will be used when grading projects.
             # You may also write your own problems.
 
-    r = open(os.path.join("Problems","ProblemSetList.txt"))    # ProblemSetList.txt lists the sets to solve.
-    line = getNextLine(r)                                   # Sets will be solved in the order they appear in the file.
-    while not line=="":                                     # You may modify ProblemSetList.txt for design and debugging.
-        sets.append(ProblemSet(line))                       # We will use a fresh copy of all problem sets when grading.
-        line=getNextLine(r)                                 # We will also use some problem sets not given in advance.
+    bundle=None
+    if bundlePath:
+        bundle=ProblemBundle(bundlePath)
+        sets=bundle.problem_sets(lazy=True)
+    else:
+        with open(os.path.join("Problems","ProblemSetList.txt")) as r:    # ProblemSetList.txt lists the sets to solve.
+            line = getNextLine(r)                                   # Sets will be solved in the order they appear in the file.
+            while not line=="":                                     # You may modify ProblemSetList.txt for design and debugging.
+                sets.append(ProblemSet(line, lazy=True))            # We will use a fresh copy of all problem sets when grading.
+                line=getNextLine(r)                                 # We will also use some problem sets not given in advance.
+
+    timingsWriter=None
+    if timings:
+        timingsWriter=SolveTimingsWriter("AgentTimings.csv",
+                                         [c.__name__ for c in Agent.PROBLEM_CLASSES])
+    try:
+        if workers > 1:
+            solveInPool(sets, workers, timingsWriter, profiler, bundlePath, grader)
+        elif readAhead > 0:
+            agent=Agent(timings_hook=timingsWriter, profiler=profiler, bundle=bundle)
+            SolvePipeline(agent, readAhead, grader).run(sets, "AgentAnswers.csv")
+        else:
+            solveSerially(sets, timingsWriter, profiler, bundle, grader)
+    finally:
+        if timingsWriter is not None:
+            timingsWriter.close()
 
+def solveSerially(sets, timingsWriter=None, profiler=None, bundle=None, grader=None):
     # Initializing problem-solving agent from Agent.java
-    agent=Agent()   # Your agent will be initialized with its default constructor.
-                    # You may modify the default constructor in Agent.java
+    agent=Agent(timings_hook=timingsWriter, profiler=profiler, bundle=bundle)  # Your agent will be initialized with its default constructor.
+                                                                # You may modify the default constructor in Agent.java
 
     # Running agent against each problem set
     with open("AgentAnswers.csv","w") as results:     # Results will be written to ProblemResults.csv.
@@ -45,19 +109,76 @@ def solve():
                                                         # Do not write anything else to ProblemResults.txt during execution of the program.
         results.write("ProblemSet,RavensProblem,Agent's Answer\n")
         for set in sets:
-            for problem in set.problems:   # Your agent will solve one problem at a time.
+            for problem in set.iterProblems():  # Your agent will solve one problem at a time.
                 #try:
                 answer = agent.Solve(problem)  # The problem will be passed to your agent as a RavensProblem object as a parameter to the Solve method
                                                 # Your agent should return its answer at the conclusion of the execution of Solve.
 
                 results.write("%s,%s,%d\n" % (set.name, problem.name, answer))
-    r.close()
+                if grader is not None:
+                    grader.grade(set.name, problem.name, answer)
+
+# Solves every problem of the given sets in a pool of worker processes.
+# imap hands answers back in submission order, so AgentAnswers.csv comes out
+# exactly as in the serial loop.
+def solveInPool(sets, workers, timingsWriter=None, profiler=None, bundlePath=None, grader=None):
+    jobs=((set.name, problem) for set in sets for problem in set.iterProblems())
+    pool=multiprocessing.Pool(workers, initializer=initWorker, initargs=(profiler, bundlePath))
+    try:
+        with open("AgentAnswers.csv","w") as results:
+            results.write("ProblemSet,RavensProblem,Agent's Answer\n")
+            for setName, problemName, answer, timings in pool.imap(solveInWorker, jobs):
+                results.write("%s,%s,%d\n" % (setName, problemName, answer))
+                if grader is not None:
+                    grader.grade(setName, problemName, answer)
+                if timingsWriter is not None:
+                    timingsWriter(timings)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
 
 # The main execution will have your agent generate answers for all the problems,
 # then generate the grades for them.
-def main():
-    solve()
-    grade()
+#
+# With streamGrading set, answers are graded while they are produced (see
+# StreamingGrader) instead of by reading AgentAnswers.csv back afterwards.
+# Bundle runs are always graded that way, against the bundle's answers, as
+# RavensGrader.grade reads the Problems directory.
+def main(workers=1, readAhead=0, timings=False, profiler=None, bundlePath=None, streamGrading=False):
+    if not streamGrading and not bundlePath:
+        solve(workers, readAhead, timings, profiler, bundlePath)
+        grade()
+        return
+
+    grader=StreamingGrader(ProblemBundle(bundlePath) if bundlePath else None)
+    try:
+        solve(workers, readAhead, timings, profiler, bundlePath, grader)
+    finally:
+        grader.close()
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Solves and grades the problem sets.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of worker processes; 0 uses one per CPU")
+    parser.add_argument("--read-ahead", type=int, default=0,
+                        help="solve as a pipeline, decoding up to this many problems ahead")
+    parser.add_argument("--timings", action="store_true",
+                        help="write per-problem stage timings to AgentTimings.csv")
+    parser.add_argument("--profile-pattern", default=None,
+                        help="profile Solve calls of problems matching this pattern, e.g. 'Basic Problem E-*'")
+    parser.add_argument("--profile-threshold", type=float, default=None,
+                        help="keep only profiles of Solve calls taking at least this many seconds")
+    parser.add_argument("--profile-dir", default=ProblemProfiler.DEFAULT_DIRECTORY,
+                        help="where to write the profiles")
+    parser.add_argument("--bundle", default=None,
+                        help="solve and grade the sets compiled into this problem bundle (see bundle.py)")
+    parser.add_argument("--stream-grading", action="store_true",
+                        help="grade every answer as it is produced instead of re-reading AgentAnswers.csv")
+    args = parser.parse_args()
+    profiler=None
+    if args.profile_pattern is not None or args.profile_threshold is not None:
+        profiler=ProblemProfiler(args.profile_dir, args.profile_pattern, args.profile_threshold)
+    main(args.workers or multiprocessing.cpu_count(), args.read_ahead, args.timings, profiler, args.bundle, args.stream_grading)
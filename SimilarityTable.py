@@ -0,0 +1,183 @@
+import numpy as np
+
+from PackedMask import PackedMask, popcount
+
+
+def count_black(rows, packed, axis=None):
+    """Counts the black pixels of rows laid out like SimilarityTable.rows."""
+
+    if packed:
+        return popcount(rows, axis=axis)
+    return np.count_nonzero(rows, axis=axis)
+
+
+def pairwise_count_ratios(black_counts):
+    """Ratio of the smaller to the larger black pixel count of every pair of
+    figures along the last axis of black_counts."""
+
+    counts = black_counts.astype(np.int64)
+    counts_1 = counts[..., :, np.newaxis]
+    counts_2 = counts[..., np.newaxis, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.minimum(counts_1, counts_2).astype(np.float64) / \
+            np.maximum(counts_1, counts_2).astype(np.float64)
+
+
+def pairwise_stats(rows, black_counts, num_pixels, packed):
+    """Match statistics of every pair of figures in rows.
+
+    Args:
+        rows (numpy.ndarray): Figures laid out like SimilarityTable.rows,
+            optionally with leading axes (e.g. one per problem).
+        black_counts (numpy.ndarray): Black pixels of every figure, shaped
+            like rows without its last axis.
+        num_pixels (int): Number of pixels in every figure.
+        packed (bool): Whether rows holds packed bits.
+
+    Return:
+        (numpy.ndarray): Fraction of pixels that match, for every pair of
+            figures along the last two axes.
+        (numpy.ndarray): Ratio of the smaller to the larger black pixel
+            count, laid out the same way.
+    """
+
+    if packed:
+        both_black = popcount(rows[..., :, np.newaxis, :] &
+                              rows[..., np.newaxis, :, :], axis=-1)
+    else:
+        # Every partial sum is an integer below 2 ** 24, so float32 products
+        # are exact.
+        masks = rows.astype(np.float32)
+        both_black = np.rint(np.matmul(
+            masks, np.swapaxes(masks, -1, -2))).astype(np.int64)
+    counts = black_counts.astype(np.int64)
+    counts_1 = counts[..., :, np.newaxis]
+    counts_2 = counts[..., np.newaxis, :]
+    matches = num_pixels - counts_1 - counts_2 + 2 * both_black
+
+    return matches / float(num_pixels), pairwise_count_ratios(black_counts)
+
+
+def match_stats_rows(rows, targets, target_counts, num_pixels, packed):
+    """Match statistics between every row of rows and every row of targets,
+    both laid out like SimilarityTable.rows with optional leading axes.
+
+    Args:
+        rows (numpy.ndarray): Figures to compare, e.g. operator results.
+        targets (numpy.ndarray): Figures to compare them with.
+        target_counts (numpy.ndarray): Black pixels of every target.
+        num_pixels (int): Number of pixels in every figure.
+        packed (bool): Whether rows and targets hold packed bits.
+
+    Return:
+        (numpy.ndarray): Fractions of pixels that match, one row per row of
+            rows and one column per target.
+        (numpy.ndarray): Ratios of the smaller to the larger black pixel
+            count, laid out the same way.
+    """
+
+    mismatches = count_black(
+        rows[..., :, np.newaxis, :] ^ targets[..., np.newaxis, :, :], packed,
+        axis=-1)
+    fractions = (num_pixels - mismatches) / float(num_pixels)
+
+    row_counts = count_black(rows, packed, axis=-1).astype(np.int64)
+    row_counts = row_counts[..., :, np.newaxis]
+    target_counts = target_counts.astype(np.int64)[..., np.newaxis, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = np.minimum(row_counts, target_counts).astype(np.float64) / \
+            np.maximum(row_counts, target_counts).astype(np.float64)
+    return fractions, ratios
+
+
+class SimilarityTable:
+    """Pairwise match statistics between every figure of a problem.
+
+    All pairs are computed in one pass: with the masks stacked as rows of M,
+    M.M^T counts the black pixels each pair shares, and together with the
+    per-figure black counts that gives the number of matching pixels. For
+    PackedMask figures the shared black pixels are popcounts of pairwise ANDs
+    instead.
+
+    rows holds the figures stacked in names order, as bool masks or, for
+    PackedMask figures, as packed bits, so that &, | and ^ on rows give the
+    same pixels as the figures' logical operators.
+    """
+
+    def __init__(self, problem_figures, batch=None, batch_index=None):
+        """
+        Args:
+            problem_figures (dict): Figure masks keyed by figure name.
+            batch (ProblemBatch): Batch the problem's statistics were
+                already computed in. The table then shares the batch's
+                arrays instead of computing its own.
+            batch_index (int): Index of the problem in batch.
+        """
+
+        self.names = sorted(problem_figures.iterkeys())
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+        self.figures = [problem_figures[name] for name in self.names]
+        self.packed = isinstance(self.figures[0], PackedMask)
+
+        if batch is not None:
+            self.num_pixels = batch.num_pixels
+            self.rows = batch.rows[batch_index]
+            self.black_counts = batch.black_counts[batch_index]
+            self.match_fractions = batch.match_fractions[batch_index]
+            self.count_ratios = batch.count_ratios[batch_index]
+            return
+
+        if self.packed:
+            self.num_pixels = self.figures[0].num_pixels
+            self.rows = np.stack([figure.bits for figure in self.figures])
+        else:
+            self.num_pixels = len(self.figures[0])
+            self.rows = np.stack(self.figures) != 0
+        self.black_counts = count_black(self.rows, self.packed, axis=-1)
+        self.match_fractions, self.count_ratios = pairwise_stats(
+            self.rows, self.black_counts, self.num_pixels, self.packed)
+
+    def count_black(self, rows, axis=None):
+        """Counts the black pixels of rows laid out like self.rows."""
+
+        return count_black(rows, self.packed, axis)
+
+    def get_indices(self, names):
+        """Returns the table indices of the named figures."""
+
+        return np.array([self.index[name] for name in names])
+
+    def black_count(self, name):
+        """Returns the number of black pixels in the named figure."""
+
+        return self.black_counts[self.index[name]]
+
+    def match_stats(self, name_1, name_2):
+        """Same as Unchanged.match_stats for two named figures.
+
+        Return:
+            (float): Fraction of pixels that match.
+            (float): Ratio of the smaller to the larger black pixel count.
+        """
+
+        i, j = self.index[name_1], self.index[name_2]
+        return float(self.match_fractions[i, j]), \
+            float(self.count_ratios[i, j])
+
+    def match_stats_with(self, fig, name):
+        """Same as Unchanged.match_stats between an arbitrary mask (e.g. the
+        result of an operator) and a named figure."""
+
+        i = self.index[name]
+        if self.packed:
+            num_pixels_match = fig.match_count(self.figures[i])
+            fig_sum = fig.black_count()
+        else:
+            num_pixels_match = np.count_nonzero(fig == self.figures[i])
+            fig_sum = np.sum(fig)
+        name_sum = self.black_counts[i]
+        min_sum = min(fig_sum, name_sum)
+        max_sum = max(fig_sum, name_sum)
+
+        return float(num_pixels_match) / float(self.num_pixels), \
+            float(min_sum) / float(max_sum)
@@ -0,0 +1,138 @@
+import sys
+import threading
+import Queue
+
+from Agent import Agent
+
+# Marks the end of a stage's output.
+END = object()
+
+
+class StageError(object):
+    """Carries an exception raised in a stage's thread to the solve stage."""
+
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+class SolvePipeline:
+    """Solves problem sets in three stages connected by bounded queues.
+
+    1. Load: parses each problem and decodes its figure masks.
+    2. Solve: runs the Agent on the decoded problem.
+    3. Write: appends the answer to the results file, and hands it to the
+       grader if one is given.
+
+    Load and write run on their own threads, so the next read_ahead problems
+    are read from disk and decoded while the current one is being solved.
+    When the load queue is full the loader blocks until the solver catches
+    up. The answers file is identical to the one RavensProject.solve writes.
+    """
+
+    def __init__(self, agent=None, read_ahead=4, grader=None):
+        """
+        Args:
+            agent (Agent): The agent to solve with. A default Agent if None.
+            read_ahead (int): How many decoded problems may wait for the
+                solver at most.
+            grader (StreamingGrader): Grades every answer as it is written.
+        """
+
+        self.agent = agent or Agent()
+        self.read_ahead = max(1, read_ahead)
+        self.grader = grader
+
+    def run(self, sets, results_filename="AgentAnswers.csv"):
+        """Solves every problem of sets, in order, and writes the answers.
+
+        Args:
+            sets (list): ProblemSets to solve.
+            results_filename (str): Path of the answers CSV to write.
+        """
+
+        loaded = Queue.Queue(self.read_ahead)
+        solved = Queue.Queue(self.read_ahead)
+        stop = threading.Event()
+        loader = threading.Thread(
+            target=self.__load, args=(sets, loaded, stop))
+        writer_errors = []
+        writer = threading.Thread(
+            target=self.__write,
+            args=(solved, results_filename, self.grader, stop, writer_errors))
+        loader.daemon = writer.daemon = True
+        loader.start()
+        writer.start()
+
+        try:
+            self.__solve(loaded, solved, stop)
+        finally:
+            solved.put(END)
+            writer.join()
+            # Stop the loader early after an error in any stage, draining the
+            # load queue so a loader blocked on a full queue can see the
+            # stop.
+            stop.set()
+            while loader.is_alive():
+                try:
+                    item = loaded.get(timeout=0.1)
+                except Queue.Empty:
+                    continue
+                if isinstance(item, tuple):
+                    item[2].release()
+            loader.join()
+
+        if writer_errors:
+            exc_info = writer_errors[0]
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    def __load(self, sets, loaded, stop):
+        try:
+            for set in sets:
+                for problem in set.iterProblems():
+                    if stop.is_set():
+                        return
+                    figure_store = None
+                    if not Agent.is_skipped(problem):
+                        figure_store = self.agent.create_figure_store(problem)
+                        figure_store.get_masks()
+                    loaded.put((set.name, problem, figure_store))
+        except Exception:
+            loaded.put(StageError(sys.exc_info()))
+        else:
+            loaded.put(END)
+
+    def __solve(self, loaded, solved, stop):
+        while True:
+            item = loaded.get()
+            if item is END:
+                return
+            if isinstance(item, StageError):
+                raise item.exc_info[0], item.exc_info[1], item.exc_info[2]
+            set_name, problem, figure_store = item
+            if stop.is_set():
+                # The writer failed: its error is raised once run returns.
+                if figure_store is not None:
+                    figure_store.release()
+                return
+            answer = self.agent.Solve(problem, figure_store)
+            solved.put((set_name, problem.name, answer))
+
+    @staticmethod
+    def __write(solved, results_filename, grader, stop, errors):
+        try:
+            with open(results_filename, "w") as results:
+                results.write("ProblemSet,RavensProblem,Agent's Answer\n")
+                while True:
+                    item = solved.get()
+                    if item is END:
+                        return
+                    results.write("%s,%s,%d\n" % item)
+                    if grader is not None:
+                        grader.grade(*item)
+        except Exception:
+            errors.append(sys.exc_info())
+            # Stop the other stages, and keep consuming so the solve stage
+            # never blocks on a full queue before it sees the stop.
+            stop.set()
+            while solved.get() is not END:
+                pass
@@ -0,0 +1,23 @@
+from SolveTimings import SolveTimings
+
+
+class SolveResult:
+    """Outcome of solving one problem, as returned by
+    Agent.solve_batch_results."""
+
+    def __init__(self, problem):
+        self.problem = problem
+        # The answer, or Base.SKIP.
+        self.answer = None
+        # The name of the problem class that solved the problem,
+        # Agent.SOLVED_BY_TRANSFORM or Agent.SOLVED_BY_SKIP.
+        self.solved_by = None
+        # The matching problem class, or None.
+        self.problem_class = None
+        # ClassificationEngine.scores of the problem, unless it was skipped.
+        self.classification_scores = None
+        # Comparisons against the match thresholds keyed by the stage that
+        # decided them (see ProblemBatch.comparisons_by_stage), when the
+        # agent prunes.
+        self.comparisons_by_stage = None
+        self.timings = SolveTimings(problem)
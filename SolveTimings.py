@@ -0,0 +1,68 @@
+import timeit
+
+# Clock used for all stage timings.
+clock = timeit.default_timer
+
+
+class SolveTimings:
+    """Time spent in each stage of one Agent.Solve call, in seconds.
+
+    decode covers loading the figure masks, classify the classification pass
+    (also broken down per problem class in classify_by_class), solve the
+    chosen class's solve() and fallback the transformation strategy used
+    when no class matched. Time spent on a whole batch of problems (see
+    Agent.solve_batch) is shared evenly by the batch's problems.
+    """
+
+    def __init__(self, problem):
+        self.problem_set_name = problem.problemSetName
+        self.problem_name = problem.name
+        self.solved_by = None
+        self.decode = 0.0
+        self.classify = 0.0
+        self.classify_by_class = []
+        self.solve = 0.0
+        self.fallback = 0.0
+        self.total = 0.0
+
+    def add_classify(self, class_name, seconds):
+        self.classify_by_class.append((class_name, seconds))
+        self.classify += seconds
+
+
+class SolveTimingsWriter:
+    """Writes SolveTimings as CSV rows, one per problem.
+
+    An instance can be passed directly as Agent's timings_hook.
+    """
+
+    def __init__(self, filename, class_names):
+        """
+        Args:
+            filename (str): Path of the CSV file to write.
+            class_names (list): Problem class names, one classify column is
+                written for each.
+        """
+
+        self.class_names = class_names
+        self.file = open(filename, 'w')
+        self.file.write(','.join(
+            ['ProblemSet', 'RavensProblem', 'SolvedBy', 'Decode',
+             'Classify'] +
+            ['Classify ' + name for name in class_names] +
+            ['Solve', 'Fallback', 'Total']) + '\n')
+
+    def __call__(self, timings):
+        self.write(timings)
+
+    def write(self, timings):
+        classify_by_class = dict(timings.classify_by_class)
+        values = [timings.decode, timings.classify] + \
+            [classify_by_class.get(name, 0.0) for name in self.class_names] + \
+            [timings.solve, timings.fallback, timings.total]
+        self.file.write('%s,%s,%s,%s\n' % (
+            timings.problem_set_name, timings.problem_name, timings.solved_by,
+            ','.join('%.6f' % value for value in values)))
+
+    def close(self):
+        self.file.close()
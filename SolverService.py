@@ -0,0 +1,429 @@
+import base64
+import io
+import json
+import os
+import socket
+import SocketServer
+import threading
+
+import numpy as np
+from PIL import Image
+
+from Agent import Agent
+from ImageUtils import ImageUtils
+from InMemoryProblem import InMemoryFigure, InMemoryProblem
+from MaskCache import MaskCache
+from MemoryMaskCache import MemoryMaskCache
+from PackedMask import PackedMask
+from ProblemSet import ProblemSet
+from SolveTimings import clock
+
+
+class SolverService:
+    """A resident solver that answers problems for clients of a local socket.
+
+    One Agent, its masks (a MemoryMaskCache, or a ProblemBundle) and the
+    imported modules stay warm between requests. Clients connect to a
+    localhost TCP port or a Unix domain socket and send JSON requests, one
+    per line; every request gets one JSON response line, and a connection
+    can carry any number of requests. Connections are handled concurrently.
+
+    Requests are objects with an op:
+        ping: {"ok": true}.
+        stats: {"ok": true, "stats": {...}} with request, problem and cache
+            counters (see get_stats).
+        solve: {"problems": [...]} where every problem is a problem
+            directory path ("Problems/<set>/<problem>"), an object
+            {"set": ..., "problem": ...}, or a figure payload (see
+            SolverClient.payload) solved as an InMemoryProblem. Answers
+            {"ok": true, "results": [{"set", "problem", "answer",
+            "solved_by"}, ...]} in the same order.
+        shutdown: stops accepting connections once the response is sent,
+            closes idle connections and lets requests in flight finish.
+    A request that fails is answered {"ok": false, "error": message}.
+    """
+
+    def __init__(self, agent=None, bundle=None):
+        """
+        Args:
+            agent (Agent): The agent to solve with. Defaults to an Agent
+                reading masks through a MemoryMaskCache in front of the
+                environment's MaskCache, or from bundle alone.
+            bundle (ProblemBundle): Bundle to look problems up in before the
+                Problems directory.
+        """
+
+        if agent is None:
+            if bundle is not None:
+                agent = Agent(mask_cache=False, bundle=bundle)
+            else:
+                agent = Agent(mask_cache=MemoryMaskCache(
+                    MaskCache.from_environment()))
+        self.agent = agent
+        self.bundle = bundle
+        self.server = None
+        self.lock = threading.Lock()
+        self.started = clock()
+        self.requests = {}
+        self.errors = 0
+        self.problems_solved = 0
+        self.solve_seconds = 0.0
+        self.connections = 0
+        # Whether each open connection is answering a request, by socket.
+        self.open_connections = {}
+        self.stopping = False
+        self.closed = threading.Condition(self.lock)
+
+    def serve(self, address):
+        """Serves requests until a shutdown request or KeyboardInterrupt.
+
+        Args:
+            address: A (host, port) pair to listen on, or the path of a Unix
+                domain socket, which is replaced if it exists.
+        """
+
+        if isinstance(address, basestring):
+            if os.path.exists(address):
+                os.remove(address)
+            self.server = ThreadingUnixServer(address, SolverRequestHandler)
+        else:
+            self.server = ThreadingTCPServer(address, SolverRequestHandler)
+        self.server.service = self
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server.server_close()
+            self.__close_connections()
+            if isinstance(address, basestring) and os.path.exists(address):
+                os.remove(address)
+
+    @property
+    def address(self):
+        """The address being served, e.g. with the port the system chose for
+        port 0."""
+
+        return self.server.server_address
+
+    def shutdown(self):
+        """Stops serve from another thread."""
+
+        self.server.shutdown()
+
+    def __close_connections(self):
+        """Closes the idle connections and waits for the requests in flight,
+        whose connections close once they are answered, until every
+        connection is closed."""
+
+        with self.lock:
+            self.stopping = True
+            for connection, busy in self.open_connections.iteritems():
+                if not busy:
+                    try:
+                        connection.shutdown(socket.SHUT_RDWR)
+                    except socket.error:
+                        pass  # Already closed by the client.
+            while self.open_connections:
+                self.closed.wait()
+
+    def handle(self, request):
+        """Answers one decoded request.
+
+        Return:
+            (dict): The response.
+        """
+
+        op = request.get('op') if isinstance(request, dict) else None
+        with self.lock:
+            self.requests[op] = self.requests.get(op, 0) + 1
+        try:
+            if op == 'ping':
+                return dict(ok=True)
+            if op == 'stats':
+                return dict(ok=True, stats=self.get_stats())
+            if op == 'solve':
+                return dict(ok=True, results=self.solve(request['problems']))
+            if op == 'shutdown':
+                # shutdown waits for serve_forever, which this request's
+                # response must not.
+                threading.Thread(target=self.shutdown).start()
+                return dict(ok=True)
+            raise ValueError('unknown op %r' % op)
+        except Exception as error:
+            with self.lock:
+                self.errors += 1
+            return dict(ok=False, error='%s: %s' % (type(error).__name__,
+                                                     error))
+
+    def solve(self, problem_refs):
+        """Solves the referenced problems as one batch.
+
+        Return:
+            (list): Result dicts in the order of problem_refs.
+        """
+
+        problems = [self.load_problem(problem_ref)
+                    for problem_ref in problem_refs]
+        start = clock()
+        results = self.agent.solve_batch_results(problems)
+        with self.lock:
+            self.problems_solved += len(results)
+            self.solve_seconds += clock() - start
+        return [dict(set=result.problem.problemSetName,
+                     problem=result.problem.name, answer=result.answer,
+                     solved_by=result.solved_by)
+                for result in results]
+
+    def load_problem(self, problem_ref):
+        """Parses a referenced problem, from the bundle if it has it."""
+
+        if not isinstance(problem_ref, basestring) and \
+                'figures' in problem_ref:
+            return self.load_payload(problem_ref)
+        if isinstance(problem_ref, basestring):
+            problem_dir = os.path.normpath(problem_ref)
+            set_name = os.path.basename(os.path.dirname(problem_dir))
+            problem_name = os.path.basename(problem_dir)
+        else:
+            set_name = problem_ref['set']
+            problem_name = problem_ref['problem']
+
+        if self.bundle is not None and \
+                problem_name in self.bundle.problems.get(set_name, {}):
+            return self.bundle.get_problem(set_name, problem_name)
+        if not os.path.isfile(os.path.join('Problems', set_name,
+                                           problem_name, 'ProblemData.txt')):
+            raise ValueError('no problem %s in set %s' % (problem_name,
+                                                         set_name))
+        return ProblemSet(set_name, lazy=True).parseProblem(problem_name)
+
+    @staticmethod
+    def load_payload(payload):
+        """Builds the InMemoryProblem of a figure payload."""
+
+        figures = {}
+        for name, figure in payload['figures'].iteritems():
+            if 'mask' in figure:
+                bits = np.frombuffer(base64.b64decode(figure['mask']),
+                                     dtype=np.uint8)
+                figures[name] = PackedMask(bits, figure['pixels'])
+            else:
+                figures[name] = base64.b64decode(figure['png'])
+        return InMemoryProblem(payload['problem'], payload['problemType'],
+                               payload['set'], figures)
+
+    def get_stats(self):
+        """Counters of the service since it started."""
+
+        with self.lock:
+            stats = dict(
+                uptime=clock() - self.started,
+                requests=dict((str(op), count)
+                              for op, count in self.requests.iteritems()),
+                errors=self.errors,
+                problems_solved=self.problems_solved,
+                solve_seconds=self.solve_seconds,
+                connections=self.connections)
+            stats['open_connections'] = len(self.open_connections)
+        masks = self.agent.bundle or self.agent.mask_cache
+        if masks is not None:
+            # Every mask source counts under its own lock.
+            with masks.lock:
+                stats['masks'] = dict(source=masks.__class__.__name__,
+                                      hits=masks.hits, misses=masks.misses)
+                if isinstance(masks, MemoryMaskCache):
+                    stats['masks']['entries'] = len(masks.entries)
+        return stats
+
+    def open_connection(self, connection):
+        with self.lock:
+            self.connections += 1
+            self.open_connections[connection] = False
+            return not self.stopping
+
+    def close_connection(self, connection):
+        with self.lock:
+            self.open_connections.pop(connection, None)
+            self.closed.notify_all()
+
+    def begin_request(self, connection):
+        """Marks a connection busy, unless the service is stopping."""
+
+        with self.lock:
+            if self.stopping:
+                return False
+            self.open_connections[connection] = True
+            return True
+
+    def end_request(self, connection):
+        """Marks a connection idle again.
+
+        Return:
+            (bool): Whether the connection may carry more requests.
+        """
+
+        with self.lock:
+            self.open_connections[connection] = False
+            return not self.stopping
+
+
+class SolverRequestHandler(SocketServer.StreamRequestHandler):
+    """Answers the JSON line requests of one connection."""
+
+    def handle(self):
+        service = self.server.service
+        if not service.open_connection(self.connection):
+            return
+        while True:
+            line = self.rfile.readline()
+            if not line or not service.begin_request(self.connection):
+                break
+            try:
+                if line.strip():
+                    self.__answer(service, line)
+            finally:
+                more = service.end_request(self.connection)
+            if not more:
+                break
+
+    def __answer(self, service, line):
+        try:
+            request = json.loads(line)
+        except ValueError as error:
+            response = dict(ok=False, error='ValueError: %s' % error)
+        else:
+            response = service.handle(request)
+        self.wfile.write(json.dumps(response) + '\n')
+        self.wfile.flush()
+
+
+class ConnectionTrackingMixIn(SocketServer.ThreadingMixIn):
+    """Serves every connection on a daemon thread and reports it closed
+    to the service once the handler is done with it.
+
+    The threads are daemons because serve waits for the requests in flight
+    itself, and an idle client must not keep the process alive.
+    """
+
+    daemon_threads = True
+
+    def shutdown_request(self, request):
+        try:
+            # UnixStreamServer shares TCPServer's shutdown_request.
+            SocketServer.TCPServer.shutdown_request(self, request)
+        finally:
+            self.service.close_connection(request)
+
+
+class ThreadingTCPServer(ConnectionTrackingMixIn, SocketServer.TCPServer):
+    allow_reuse_address = True
+
+
+class ThreadingUnixServer(ConnectionTrackingMixIn,
+                          SocketServer.UnixStreamServer):
+    pass
+
+
+class SolverClient:
+    """Client of a SolverService."""
+
+    def __init__(self, address, timeout=None):
+        """
+        Args:
+            address: The service's (host, port) or Unix domain socket path.
+            timeout (float): Seconds to wait for a response, or None.
+        """
+
+        family = socket.AF_UNIX if isinstance(address, basestring) \
+            else socket.AF_INET
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(address)
+        self.file = self.socket.makefile('rwb')
+
+    def request(self, **request):
+        """Sends a request and returns its response's fields.
+
+        Raises:
+            RuntimeError: If the service could not answer the request.
+        """
+
+        self.file.write(json.dumps(request) + '\n')
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise RuntimeError('the solver service closed the connection')
+        response = json.loads(line)
+        if not response.get('ok'):
+            raise RuntimeError(response.get('error'))
+        return response
+
+    @staticmethod
+    def payload(problem, masks=False):
+        """Encodes a problem's figures into a payload solve accepts, so
+        the service needs no access to them.
+
+        Args:
+            problem (RavensProblem): A problem from the Problems directory or
+                an InMemoryProblem.
+            masks (bool): Whether to send packed masks instead of PNG files.
+                Masks are smaller but only drawn in black and white for the
+                Transform strategy.
+        """
+
+        figures = {}
+        for name, figure in problem.figures.iteritems():
+            if masks:
+                mask = figure.get_mask(True) \
+                    if isinstance(figure, InMemoryFigure) else None
+                if mask is None:
+                    mask = PackedMask.pack(ImageUtils.get_image_data(
+                        SolverClient.__open_image(figure)))
+                figures[name] = dict(
+                    mask=base64.b64encode(mask.bits.tobytes()),
+                    pixels=mask.num_pixels)
+            elif isinstance(figure, InMemoryFigure) and \
+                    figure.png is not None:
+                figures[name] = dict(png=base64.b64encode(figure.png))
+            elif isinstance(figure, InMemoryFigure):
+                png = io.BytesIO()
+                figure.open_image().save(png, 'PNG')
+                figures[name] = dict(png=base64.b64encode(png.getvalue()))
+            else:
+                with open(figure.visualFilename, 'rb') as r:
+                    figures[name] = dict(png=base64.b64encode(r.read()))
+        return dict(set=problem.problemSetName, problem=problem.name,
+                    problemType=problem.problemType, figures=figures)
+
+    @staticmethod
+    def __open_image(figure):
+        if isinstance(figure, InMemoryFigure):
+            return figure.open_image()
+        return Image.open(figure.visualFilename)
+
+    def ping(self):
+        self.request(op='ping')
+
+    def stats(self):
+        return self.request(op='stats')['stats']
+
+    def solve(self, problems):
+        """Solves problems, given as problem directory paths,
+        {"set": ..., "problem": ...} dicts or payloads, and returns their
+        result dicts."""
+
+        return self.request(op='solve', problems=problems)['results']
+
+    def shutdown(self):
+        self.request(op='shutdown')
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
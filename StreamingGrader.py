@@ -0,0 +1,92 @@
+import collections
+import os
+
+from RavensGrader import outcome
+
+OUTCOMES = ["Correct", "Incorrect", "Skipped"]
+
+
+class StreamingGrader:
+    """Grades answers as they are produced, in place of RavensGrader.grade.
+
+    grade() scores every answer on arrival and appends its row to
+    ProblemResults.csv; close() writes SetResults.csv from the running
+    per-set totals. Given answers in the order RavensProject.solve produces
+    them, both files are the ones RavensGrader.grade writes after reading
+    AgentAnswers.csv back.
+
+    The correct answers of a set are indexed once, the first time one of its
+    answers arrives: from the ProblemBundle if it has the set, otherwise from
+    the set's ProblemAnswer.txt files.
+    """
+
+    def __init__(self, bundle=None, results_filename="ProblemResults.csv",
+                 set_results_filename="SetResults.csv"):
+        """
+        Args:
+            bundle (ProblemBundle): Bundle to read correct answers from.
+            results_filename (str): Path of the per-problem results CSV.
+            set_results_filename (str): Path of the per-set results CSV.
+        """
+
+        self.bundle = bundle
+        self.set_results_filename = set_results_filename
+        self.answer_indexes = {}
+        # Outcome counts by set, in the order the sets were graded.
+        self.totals = collections.OrderedDict()
+        self.results = open(results_filename, "w")
+        self.results.write("Problem,Agent's Answer,Correct?,Correct Answer\n")
+
+    def grade(self, set_name, problem_name, answer):
+        """Scores an answer and writes its row.
+
+        Return:
+            (str): The outcome, "Correct", "Incorrect" or "Skipped".
+        """
+
+        answers = self.answer_indexes.get(set_name)
+        if answers is None:
+            answers = self.answer_indexes[set_name] = \
+                self.load_answers(set_name)
+            self.totals[set_name] = dict.fromkeys(OUTCOMES, 0)
+        truth = answers[problem_name]
+        if truth is None:
+            raise ValueError("%s of %s has no correct answer" % (problem_name,
+                                                                 set_name))
+        result = outcome(truth, answer)
+        self.results.write("%s,%d,%s,%d\n" % (problem_name, answer, result,
+                                              truth))
+        self.totals[set_name][result] += 1
+        return result
+
+    def load_answers(self, set_name):
+        """Returns the correct answer of every problem of a set by name."""
+
+        if self.bundle is not None and set_name in self.bundle.problems:
+            return dict((problem_name, self.bundle.answer(set_name,
+                                                          problem_name))
+                        for problem_name in self.bundle.problem_names(
+                            set_name))
+
+        answers = {}
+        set_dir = os.path.join("Problems", set_name)
+        with open(os.path.join(set_dir, "ProblemList.txt")) as r:
+            for line in r:
+                problem_name = line.rstrip()
+                if not problem_name:
+                    continue
+                with open(os.path.join(set_dir, problem_name,
+                                       "ProblemAnswer.txt")) as answer:
+                    answers[problem_name] = int(answer.read())
+        return answers
+
+    def close(self):
+        """Closes ProblemResults.csv and writes SetResults.csv."""
+
+        self.results.close()
+        with open(self.set_results_filename, "w") as set_results:
+            set_results.write("Set,Correct,Incorrect,Skipped\n")
+            for set_name, totals in self.totals.iteritems():
+                set_results.write("%s,%d,%d,%d\n" % (
+                    set_name, totals["Correct"], totals["Incorrect"],
+                    totals["Skipped"]))
@@ -1,52 +1,140 @@
-from PIL import Image
+import numpy as np
 from ImageUtils import ImageUtils
 
 
 class Transform:
+    # Order in which transformations are tried. Also the row order of
+    # variant stacks returned by get_variant_stack.
+    NAMES = [
+        'unchanged',
+        'reflected_vert',
+        'reflected_horiz',
+        'rotated_90',
+        'rotated_180',
+        'rotated_270'
+    ]
+
+    # Zero-copy equivalents of the PIL transposes on a (height, width) grid.
+    # np.rot90 rotates counter-clockwise, the same as Image.ROTATE_*.
+    VARIANTS = {
+        'unchanged': lambda grid: grid,
+        'reflected_vert': lambda grid: grid[::-1],  # FLIP_TOP_BOTTOM
+        'reflected_horiz': lambda grid: grid[:, ::-1],  # FLIP_LEFT_RIGHT
+        'rotated_90': lambda grid: np.rot90(grid, 1),
+        'rotated_180': lambda grid: np.rot90(grid, 2),
+        'rotated_270': lambda grid: np.rot90(grid, 3)
+    }
+
     @staticmethod
-    def generate_transforms_data(image1_data, image2_data):
+    def generate_transforms_data(image1_data, image2_data, batched=False):
         """Generates transformations along with percentage matches.
 
+        Transformations are scored one at a time and scoring stops as soon
+        as one matches better than 98%. With batched=True every variant is
+        scored in a single array operation instead; the result is the same.
+
         Args:
+            image1_data (dict): Dictionary of image data in the form:
+                dict(image).
             image2_data (dict): Dictionary of image data in the form:
-                dict(image, pixels).
-            image2_data (dict): Dictionary of image data in the form:
-                dict(image, pixels).
+                dict(image).
+            batched (bool): Score all variants at once.
 
         Return:
             (dict): Dictionary of transform data in the form:
                 dict(transform, match).
         """
 
-        transformations = dict(
-            unchanged=Transform('unchanged', image1_data, image2_data),
-            reflected_vert=Transform(
-                'reflected_vert', image1_data, image2_data),
-            reflected_horiz=Transform(
-                'reflected_horiz', image1_data, image2_data),
-            rotated_90=Transform('rotated_90', image1_data, image2_data),
-            rotated_180=Transform('rotated_180', image1_data, image2_data),
-            rotated_270=Transform('rotated_270', image1_data, image2_data)
-        )
-
-        transformations_names = [
-            'unchanged',
-            'reflected_vert',
-            'reflected_horiz',
-            'rotated_90',
-            'rotated_180',
-            'rotated_270'
-        ]
-
-        best_match = transformations['unchanged']
-        for transformation in transformations_names:
-            if transformations[transformation].match > best_match.match:
-                best_match = transformations[transformation]
+        if batched:
+            matches = Transform.score_variants(image1_data, [image2_data])
+            transformations = [
+                Transform(name, image1_data, image2_data, matches[i][0])
+                for i, name in enumerate(Transform.NAMES)]
+        else:
+            transformations = (
+                Transform(name, image1_data, image2_data)
+                for name in Transform.NAMES)
+
+        best_match = None
+        for transformation in transformations:
+            if best_match is None:
+                best_match = transformation
+            elif transformation.match > best_match.match:
+                best_match = transformation
                 if best_match.match > .98:
                     break
         return {best_match.name: best_match}
 
-    def __init__(self, name, image1_data, image2_data):
+    @staticmethod
+    def get_pixel_grid(image_data):
+        """Returns the (height, width) pixel grid of an image, decoding it on
+        first use and caching it in image_data."""
+
+        grid = image_data.get('grid')
+        if grid is None:
+            grid = ImageUtils.get_pixel_grid(image_data['image'])
+            image_data['grid'] = grid
+        return grid
+
+    @staticmethod
+    def get_variant(name, image_data):
+        """Returns the named dihedral variant of an image as a view of its
+        pixel grid. Variants are cached in image_data."""
+
+        variants = image_data.setdefault('variants', {})
+        variant = variants.get(name)
+        if variant is None:
+            variant = Transform.VARIANTS[name](
+                Transform.get_pixel_grid(image_data))
+            variants[name] = variant
+        return variant
+
+    @staticmethod
+    def get_variant_stack(image_data):
+        """Returns every variant of an image flattened into one
+        (len(NAMES), pixels) array, built once and cached in image_data."""
+
+        stack = image_data.get('variant_stack')
+        if stack is None:
+            stack = np.stack([
+                Transform.get_variant(name, image_data).reshape(-1)
+                for name in Transform.NAMES])
+            image_data['variant_stack'] = stack
+        return stack
+
+    @staticmethod
+    def score_variants(image_data, targets_data):
+        """Scores every variant of an image against every target image in one
+        batched comparison.
+
+        Args:
+            image_data (dict): Image data of the image to transform.
+            targets_data (list): Image data of the images to compare with.
+
+        Return:
+            (list): Match percentages indexed as [variant][target], variants
+                in NAMES order.
+        """
+
+        stack = Transform.get_variant_stack(image_data)
+        targets = np.stack([
+            Transform.get_pixel_grid(target_data).reshape(-1)
+            for target_data in targets_data])
+        matches = np.count_nonzero(
+            stack[:, np.newaxis, :] == targets[np.newaxis, :, :], axis=2)
+        return (matches / float(stack.shape[1])).tolist()
+
+    @staticmethod
+    def match_variant(name, image1_data, image2_data):
+        variant = Transform.get_variant(name, image1_data)
+        target = Transform.get_pixel_grid(image2_data)
+        if variant.shape != target.shape:
+            return ImageUtils.match_percentage(
+                variant.reshape(-1), target.reshape(-1))
+        return float(np.count_nonzero(variant == target)) / \
+            float(variant.size)
+
+    def __init__(self, name, image1_data, image2_data, match=None):
         self.transformations_map = {
             'unchanged': self.match_unchanged,
             'reflected_vert': self.match_reflected_vert,
@@ -59,44 +147,48 @@ class Transform:
         self.name = name
         self.image1_data = image1_data
         self.image2_data = image2_data
-        self.match = self.transformations_map[name](image1_data, image2_data)
+        if match is None:
+            match = self.transformations_map[name](image1_data, image2_data)
+        self.match = match
 
     def match_unchanged(self, image1_data, image2_data):
-        return ImageUtils.match_percentage(
-            image1_data['pixels'], image2_data['pixels']
-        )
+        return Transform.match_variant('unchanged', image1_data, image2_data)
 
     def match_reflected_vert(self, image1_data, image2_data):
-        return ImageUtils.match_percentage(
-            image1_data['image'].transpose(Image.FLIP_TOP_BOTTOM).getdata(),
-            image2_data['pixels']
-        )
+        return Transform.match_variant(
+            'reflected_vert', image1_data, image2_data)
 
     def match_reflected_horiz(self, image1_data, image2_data):
-        return ImageUtils.match_percentage(
-            image1_data['image'].transpose(Image.FLIP_LEFT_RIGHT).getdata(),
-            image2_data['pixels']
-        )
+        return Transform.match_variant(
+            'reflected_horiz', image1_data, image2_data)
 
     def match_rotated_90(self, image1_data, image2_data):
-        return ImageUtils.match_percentage(
-            image1_data['image'].transpose(Image.ROTATE_90).getdata(),
-            image2_data['pixels']
-        )
+        return Transform.match_variant('rotated_90', image1_data, image2_data)
 
     def match_rotated_180(self, image1_data, image2_data):
-        return ImageUtils.match_percentage(
-            image1_data['image'].transpose(Image.ROTATE_180).getdata(),
-            image2_data['pixels']
-        )
+        return Transform.match_variant(
+            'rotated_180', image1_data, image2_data)
 
     def match_rotated_270(self, image1_data, image2_data):
-        return ImageUtils.match_percentage(
-            image1_data['image'].transpose(Image.ROTATE_270).getdata(),
-            image2_data['pixels']
-        )
+        return Transform.match_variant(
+            'rotated_270', image1_data, image2_data)
 
     def apply_and_compare(self, image1_data, image2_data):
         """Applies this transformation to image1 and compares with image2."""
 
         return self.transformations_map[self.name](image1_data, image2_data)
+
+    def apply_and_compare_all(self, image1_data, images_data):
+        """Applies this transformation to image1 and compares it with each of
+        images_data in one batched comparison.
+
+        Return:
+            (list): Match percentages in the order of images_data.
+        """
+
+        variant = Transform.get_variant(self.name, image1_data).reshape(-1)
+        targets = np.stack([
+            Transform.get_pixel_grid(image_data).reshape(-1)
+            for image_data in images_data])
+        matches = np.count_nonzero(targets == variant, axis=1)
+        return (matches / float(variant.size)).tolist()
@@ -1,31 +1,36 @@
 from Base import Base
+from PackedMask import PackedMask
+from ProblemFigures import ProblemFigures
 import numpy as np
 import operator
 
 
 class Unchanged(Base):
+    # Two figures match if either statistic reaches its threshold.
+    MATCH_FRACTION_THRESHOLD = 0.97
+    COUNT_RATIO_THRESHOLD = 0.985
+
     @staticmethod
     def is_class(problem_figures):
+        table = ProblemFigures.wrap(problem_figures).similarity_table
+
         for trans_group in Base.TRANS_GROUPS:
-            trans_1 = problem_figures[trans_group[0]]
-            trans_2 = problem_figures[trans_group[1]]
-            trans_3 = problem_figures[trans_group[2]]
-
-            test_group = Base.TRANS_TO_TEST_MAP[trans_group]
-            test_1 = problem_figures[test_group[0]]
-            test_2 = problem_figures[test_group[1]]
-            test_3 = problem_figures[test_group[2]]
-
-            if Unchanged.is_match(trans_1, trans_2) and \
-                    Unchanged.is_match(trans_2, trans_3) and \
-                    Unchanged.is_match(test_1, test_2) and \
-                    Unchanged.is_match(test_2, test_3):
+            trans_1, trans_2, trans_3 = trans_group
+            test_1, test_2, test_3 = Base.TRANS_TO_TEST_MAP[trans_group]
+
+            if Unchanged.is_table_match(table, trans_1, trans_2) and \
+                    Unchanged.is_table_match(table, trans_2, trans_3) and \
+                    Unchanged.is_table_match(table, test_1, test_2) and \
+                    Unchanged.is_table_match(table, test_2, test_3):
                 return True
 
         return False
 
     @staticmethod
     def match_stats(fig_1, fig_2):
+        if isinstance(fig_1, PackedMask):
+            return fig_1.match_stats(fig_2)
+
         num_pixels_match = np.count_nonzero(fig_1 == fig_2)
         num_pixels = len(fig_1)
         fig_1_sum = np.sum(fig_1)
@@ -37,31 +42,106 @@ class Unchanged(Base):
                float(min_sum) / float(max_sum)
 
     @staticmethod
-    def is_match(fig_1, fig_2, blk_count_thresh=0.97, match_pcnt_tresh=0.985):
-        return Unchanged.match_stats(fig_1, fig_2)[0] >= blk_count_thresh or \
-               Unchanged.match_stats(fig_1, fig_2)[1] >= match_pcnt_tresh
+    def is_match(fig_1, fig_2, blk_count_thresh=MATCH_FRACTION_THRESHOLD,
+                 match_pcnt_tresh=COUNT_RATIO_THRESHOLD):
+        return Unchanged.is_stats_match(Unchanged.match_stats(fig_1, fig_2),
+                                        blk_count_thresh, match_pcnt_tresh)
 
+    @staticmethod
+    def is_table_match(table, name_1, name_2,
+                       blk_count_thresh=MATCH_FRACTION_THRESHOLD,
+                       match_pcnt_tresh=COUNT_RATIO_THRESHOLD):
+        """Same as is_match for two named figures, read from the problem's
+        SimilarityTable."""
+
+        return Unchanged.is_stats_match(table.match_stats(name_1, name_2),
+                                        blk_count_thresh, match_pcnt_tresh)
+
+    @staticmethod
+    def is_stats_match(match_stats,
+                       blk_count_thresh=MATCH_FRACTION_THRESHOLD,
+                       match_pcnt_tresh=COUNT_RATIO_THRESHOLD):
+        return match_stats[0] >= blk_count_thresh or \
+               match_stats[1] >= match_pcnt_tresh
+
+    @staticmethod
+    def are_stats_match(fractions, ratios,
+                        blk_count_thresh=MATCH_FRACTION_THRESHOLD,
+                        match_pcnt_tresh=COUNT_RATIO_THRESHOLD):
+        """Element-wise is_stats_match on arrays of match fractions and
+        count ratios. A ratio of two blank figures is NaN and never
+        matches."""
+
+        with np.errstate(invalid='ignore'):
+            return (fractions >= blk_count_thresh) | \
+                (ratios >= match_pcnt_tresh)
 
     def __init__(self, problem_figures):
         self.problem_figures = problem_figures
 
     def solve(self):
-        solutions = {Base.SKIP: Base.SKIP}
+        table = ProblemFigures.wrap(self.problem_figures).similarity_table
+        return Unchanged.pick_solution(*Unchanged.score_solutions(
+            table, table.match_fractions, table.count_ratios))
+
+    @staticmethod
+    def solve_batch(batch, indices):
+        return [Unchanged.pick_solution(*stats)
+                for stats in zip(*Unchanged.score_solutions(
+                    batch, batch.match_fractions[indices],
+                    batch.count_ratios[indices]))]
 
-        for app_group in Base.APP_GROUPS:
-            app_1 = self.problem_figures[app_group[0]]
-            app_2 = self.problem_figures[app_group[1]]
+    @staticmethod
+    def score_solutions(figures_index, match_fractions, count_ratios):
+        """Scores every solution against every app group at once.
+
+        Args:
+            figures_index (SimilarityTable): Maps figure names to indices
+                (a ProblemBatch works too).
+            match_fractions (numpy.ndarray): Pairwise match fractions as in
+                SimilarityTable, optionally with a leading problem axis.
+            count_ratios (numpy.ndarray): Pairwise count ratios, laid out
+                the same way.
+
+        Return:
+            (numpy.ndarray): Whether each solution matches, one row per app
+                group and one column per solution.
+            (numpy.ndarray): Match fractions against the first figure of
+                each app group, laid out the same way.
+            (numpy.ndarray): Count ratios, laid out the same way.
+        """
+
+        solutions_index = figures_index.get_indices(
+            Base.SOLUTION_FIGURE_KEYS)[np.newaxis, :]
+        apps_1_index = figures_index.get_indices(
+            [app_group[0] for app_group in Base.APP_GROUPS])[:, np.newaxis]
+        apps_2_index = figures_index.get_indices(
+            [app_group[1] for app_group in Base.APP_GROUPS])[:, np.newaxis]
+        fractions = match_fractions[..., apps_1_index, solutions_index]
+        ratios = count_ratios[..., apps_1_index, solutions_index]
+        matches = \
+            Unchanged.are_stats_match(fractions, ratios) & \
+            Unchanged.are_stats_match(
+                match_fractions[..., apps_2_index, solutions_index],
+                count_ratios[..., apps_2_index, solutions_index])
+        return matches, fractions, ratios
 
-            if Unchanged.match_stats(app_1, app_2):
-                for solution in Base.SOLUTION_FIGURE_KEYS:
-                    solution_fig = self.problem_figures[solution]
+    @staticmethod
+    def pick_solution(matches, fractions, ratios):
+        """Picks the matching solution with the best average of match
+        fraction and count ratio, from (app groups x solutions) arrays as
+        returned by score_solutions. A later app group's score for a
+        solution replaces an earlier one's.
 
-                    match_stats = \
-                        Unchanged.match_stats(solution_fig, app_1)
+        Return:
+            (int): The solution, or Base.SKIP if none matches.
+        """
 
-                    if Unchanged.is_match(solution_fig, app_1) and \
-                            Unchanged.is_match(solution_fig, app_2):
-                        avg_match = (match_stats[0] + match_stats[1]) / 2.0
-                        solutions[int(solution)] = avg_match
+        solutions = {Base.SKIP: Base.SKIP}
+        for i in range(len(Base.APP_GROUPS)):
+            for j, solution in enumerate(Base.SOLUTION_FIGURE_KEYS):
+                if matches[i, j]:
+                    avg_match = (fractions[i, j] + ratios[i, j]) / 2.0
+                    solutions[int(solution)] = avg_match
 
         return max(solutions.iteritems(), key=operator.itemgetter(1))[0]
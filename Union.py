@@ -1,9 +1,22 @@
 from LogicalOperator import LogicalOperator
+from PackedMask import PackedMask
+import numpy as np
 
 
 class Union(LogicalOperator):
     @staticmethod
     def do_operator(fig_1, fig_2):
+        if isinstance(fig_1, PackedMask):
+            return fig_1 | fig_2
         union = fig_1 + fig_2
         union[union > 1] = 1  # reset all 2's to 1's (1 = black pixel)
         return union
+
+    @staticmethod
+    def do_row_operator(rows_1, rows_2):
+        return rows_1 | rows_2
+
+    @staticmethod
+    def block_bounds(blocks_1, blocks_2, block_size):
+        return np.maximum(blocks_1, blocks_2), \
+            np.minimum(blocks_1 + blocks_2, block_size)
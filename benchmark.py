@@ -0,0 +1,180 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+
+import numpy as np
+
+from Agent import Agent
+from ProblemSet import ProblemSet
+
+
+def percentile(sorted_values, percent):
+    """Nearest-rank percentile of an already sorted list."""
+
+    if not sorted_values:
+        return None
+    rank = int(np.ceil(percent / 100.0 * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def latency_summary(latencies):
+    """Count, mean and p50/p95/p99 of a list of latencies in seconds."""
+
+    latencies = sorted(latencies)
+    return dict(
+        count=len(latencies),
+        mean=sum(latencies) / len(latencies) if latencies else None,
+        p50=percentile(latencies, 50),
+        p95=percentile(latencies, 95),
+        p99=percentile(latencies, 99))
+
+
+def git_revision():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def all_sets(problems_dir):
+    return sorted(
+        name for name in os.listdir(problems_dir)
+        if os.path.isfile(os.path.join(problems_dir, name, 'ProblemList.txt')))
+
+
+def solve_all(agent, problems):
+    """Solves every problem once and returns (solved_by, seconds) for each.
+    The agent's progress output is discarded."""
+
+    timings = []
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            for problem in problems:
+                start = timeit.default_timer()
+                agent.Solve(problem)
+                timings.append(
+                    (agent.solved_by, timeit.default_timer() - start))
+        finally:
+            sys.stdout = stdout
+    return timings
+
+
+def run_benchmark(args):
+    """Solves the problems of args.sets repeatedly and reports throughput
+    and latency. Problems the agent skips are timed in latency_by_class
+    only: skipping takes microseconds, so counting them would inflate the
+    throughput and deflate the latency of actually solving."""
+
+    problems = []
+    for set_name in args.sets:
+        problems.extend(ProblemSet(set_name).problems)
+
+    agent = Agent(mask_cache=None if args.mask_cache else False,
+                  packed=args.packed, prune=args.prune,
+                  coarse_to_fine=args.coarse_to_fine, align=args.align)
+
+    for _ in range(args.warmup):
+        solve_all(agent, problems)
+
+    latencies = []
+    by_class = {}
+    runs = []
+    for _ in range(args.repeat):
+        start = timeit.default_timer()
+        timings = solve_all(agent, problems)
+        elapsed = timeit.default_timer() - start
+        solved = [seconds for solved_by, seconds in timings
+                  if solved_by != Agent.SOLVED_BY_SKIP]
+        runs.append(dict(seconds=elapsed, solved_seconds=sum(solved),
+                         problems_per_second=len(solved) / sum(solved)
+                         if solved else None))
+        latencies.extend(solved)
+        for solved_by, seconds in timings:
+            by_class.setdefault(solved_by, []).append(seconds)
+
+    solved_seconds = sum(run['solved_seconds'] for run in runs)
+    num_skipped = len(by_class.get(Agent.SOLVED_BY_SKIP, [])) // len(runs)
+    return dict(
+        revision=git_revision(),
+        timestamp=datetime.datetime.utcnow().isoformat() + 'Z',
+        python=platform.python_version(),
+        numpy=np.__version__,
+        options=dict(sets=args.sets, warmup=args.warmup, repeat=args.repeat,
+                     packed=args.packed, mask_cache=args.mask_cache,
+                     prune=args.prune, coarse_to_fine=args.coarse_to_fine,
+                     align=args.align),
+        problems=len(problems),
+        skipped=num_skipped,
+        problems_per_second=len(latencies) / solved_seconds
+        if latencies else None,
+        runs=runs,
+        latency=latency_summary(latencies),
+        latency_by_class=dict(
+            (solved_by, latency_summary(class_latencies))
+            for solved_by, class_latencies in by_class.iteritems()))
+
+
+def print_report(report):
+    print 'problems: %d (%d skipped)  runs: %d  solved problems/sec: %s' % (
+        report['problems'], report['skipped'], len(report['runs']),
+        '%.1f' % report['problems_per_second']
+        if report['problems_per_second'] else '-')
+    rows = sorted(report['latency_by_class'].iteritems())
+    if report['latency']['count']:
+        rows.insert(0, ('all solved', report['latency']))
+    print '%-18s %6s %10s %10s %10s' % ('solved by', 'count', 'p50 ms',
+                                         'p95 ms', 'p99 ms')
+    for name, summary in rows:
+        print '%-18s %6d %10.3f %10.3f %10.3f' % (
+            name, summary['count'], summary['p50'] * 1000,
+            summary['p95'] * 1000, summary['p99'] * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measures Agent.Solve throughput and per-problem latency '
+                    'over the problem sets.')
+    parser.add_argument('--sets', nargs='+', default=None,
+                        help='problem sets to run (default: every set in '
+                             'Problems/; skipped problems are reported on '
+                             'their own)')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='unmeasured passes over the problems')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='measured passes over the problems')
+    parser.add_argument('--packed', action='store_true',
+                        help='solve on bit-packed masks')
+    parser.add_argument('--prune', action='store_true',
+                        help='skip comparisons the figure summaries reject')
+    parser.add_argument('--coarse-to-fine', action='store_true',
+                        help='reject comparisons on figure pyramids first')
+    parser.add_argument('--align', action='store_true',
+                        help='compare figures at their best offset')
+    parser.add_argument('--no-mask-cache', dest='mask_cache',
+                        action='store_false',
+                        help='decode every PNG instead of using the mask cache')
+    parser.add_argument('--output', default='benchmark.json',
+                        help='where to write the JSON report')
+    args = parser.parse_args()
+    if args.sets is None:
+        args.sets = all_sets('Problems')
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+
+    report = run_benchmark(args)
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+    print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import argparse
+import os
+import timeit
+
+from ProblemBundle import ProblemBundle
+
+
+def compile_bundle(args):
+    start = timeit.default_timer()
+    num_problems = ProblemBundle.compile(args.output, args.sets)
+    print 'compiled %d problems into %s (%d bytes) in %.2fs' % (
+        num_problems, args.output, os.path.getsize(args.output),
+        timeit.default_timer() - start)
+
+
+def show_bundle(args):
+    bundle = ProblemBundle(args.bundle)
+    for set_name in bundle.sets:
+        problem_names = bundle.problem_names(set_name)
+        num_figures = sum(
+            len(bundle.problems[set_name][name]['figures'])
+            for name in problem_names)
+        print '%-24s %4d problems %5d figures' % (set_name,
+                                                  len(problem_names),
+                                                  num_figures)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compiles problem sets into a single ProblemBundle file '
+                    'and inspects bundles.')
+    subparsers = parser.add_subparsers(dest='command')
+    compile_parser = subparsers.add_parser(
+        'compile', help='compile problem sets from the Problems directory')
+    compile_parser.add_argument('sets', nargs='*',
+                                help='sets to compile (default: the sets in '
+                                     'ProblemSetList.txt)')
+    compile_parser.add_argument('-o', '--output',
+                                default=ProblemBundle.DEFAULT_PATH,
+                                help='where to write the bundle')
+    compile_parser.set_defaults(run=compile_bundle)
+    show_parser = subparsers.add_parser(
+        'show', help='list the sets and problems of a bundle')
+    show_parser.add_argument('bundle', nargs='?',
+                             default=ProblemBundle.DEFAULT_PATH)
+    show_parser.set_defaults(run=show_bundle)
+    args = parser.parse_args()
+    if args.command == 'compile' and not args.sets:
+        args.sets = None
+
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
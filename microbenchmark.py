@@ -0,0 +1,223 @@
+import argparse
+import json
+import os
+import timeit
+
+import numpy as np
+from PIL import Image
+
+from Disjunction import Disjunction
+from ImageUtils import ImageUtils
+from Intersection import Intersection
+from PackedMask import PackedMask
+from PixelAddition import PixelAddition
+from PixelSubtraction import PixelSubtraction
+from SimilarityTable import SimilarityTable
+from Transform import Transform
+from Unchanged import Unchanged
+from Union import Union
+
+DEFAULT_PROBLEM = os.path.join('Problems', 'Basic Problems E',
+                               'Basic Problem E-01')
+
+
+def time_per_op(func, min_time, repeat):
+    """Best time of one call in nanoseconds. The number of calls per
+    measurement grows until one measurement takes at least min_time."""
+
+    timer = timeit.Timer(func)
+    number = 1
+    while timer.timeit(number) < min_time and number < 1 << 20:
+        number *= 2
+    return min(timer.repeat(repeat, number)) / number * 1e9
+
+
+def result_bytes_per_op(func):
+    """Bytes of the NumPy arrays returned by one call of func.
+
+    Python 2 has no tracemalloc, so only the result's buffers are counted:
+    every array reachable from the result (through containers, PackedMasks
+    and object attributes) is followed to the array owning its memory, and
+    each owner's nbytes is counted once. This is not what func allocates:
+    temporaries freed before func returns are not measured, so a kernel
+    returning a scalar reports 0.
+    """
+
+    return buffer_bytes(func(), set())
+
+
+def buffer_bytes(value, seen):
+    """Bytes of the distinct array buffers reachable from value."""
+
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, np.ndarray):
+        owner = value
+        while isinstance(owner.base, np.ndarray):
+            owner = owner.base
+        if owner is not value:
+            return buffer_bytes(owner, seen)
+        return value.nbytes if value.dtype != object else sum(
+            buffer_bytes(item, seen) for item in value.flat)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sum(buffer_bytes(item, seen) for item in value)
+    if isinstance(value, dict):
+        return sum(buffer_bytes(item, seen) for item in value.itervalues())
+    if hasattr(value, '__dict__'):
+        return buffer_bytes(vars(value), seen)
+    return 0
+
+
+def synthetic_mask(size, density, seed):
+    """Random flat np.int_ mask of size x size pixels."""
+
+    random = np.random.RandomState(seed)
+    return np.int_(random.random_sample(size * size) < density)
+
+
+def load_figures(problem_dir):
+    images = {}
+    for name in ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H',
+                 '1', '2', '3', '4', '5', '6', '7', '8']:
+        image = Image.open(os.path.join(problem_dir, name + '.png'))
+        image.load()
+        images[name] = image
+    return images
+
+
+def figure_kernels(images):
+    """Kernels run on the figures of a real problem."""
+
+    image_1, image_2 = images['A'], images['B']
+    mask_1 = ImageUtils.get_image_data(image_1)
+    mask_2 = ImageUtils.get_image_data(image_2)
+    rgba_1, rgba_2 = np.asarray(image_1), np.asarray(image_2)
+    pixels_2 = list(image_2.getdata())
+    masks = dict((name, ImageUtils.get_image_data(image))
+                 for name, image in images.iteritems())
+    packed_masks = dict((name, PackedMask.pack(mask))
+                        for name, mask in masks.iteritems())
+
+    kernels = [
+        ('ImageUtils.get_image_data', lambda: ImageUtils.get_image_data(
+            image_1)),
+        ('ImageUtils.get_image_mask', lambda: ImageUtils.get_image_mask(
+            image_1)),
+        ('ImageUtils.get_image_data_pixelwise',
+         lambda: ImageUtils.get_image_data_pixelwise(image_1)),
+        ('ImageUtils.match_percentage[mask]',
+         lambda: ImageUtils.match_percentage(mask_1, mask_2)),
+        ('ImageUtils.match_percentage[rgba]',
+         lambda: ImageUtils.match_percentage(rgba_1, rgba_2)),
+        ('ImageUtils.match_percentage[pixel list]',
+         lambda: ImageUtils.match_percentage(rgba_1, pixels_2)),
+        ('ImageUtils.black_pixel_count[rgba]',
+         lambda: ImageUtils.black_pixel_count(rgba_1)),
+        ('SimilarityTable[16 figures]', lambda: SimilarityTable(masks)),
+        ('SimilarityTable[16 packed figures]',
+         lambda: SimilarityTable(packed_masks)),
+    ]
+
+    for name in Transform.NAMES:
+        # A fresh image data dict per call measures building the variant as
+        # well as comparing it; the pixel grids are decoded up front.
+        grid_1 = ImageUtils.get_pixel_grid(image_1)
+        image_2_data = dict(grid=ImageUtils.get_pixel_grid(image_2))
+        kernels.append((
+            'Transform.match_%s' % name,
+            lambda name=name, grid_1=grid_1, image_2_data=image_2_data:
+                Transform.match_variant(name, dict(grid=grid_1),
+                                        image_2_data)))
+    image_1_data = dict(grid=ImageUtils.get_pixel_grid(image_1))
+    targets_data = [dict(grid=ImageUtils.get_pixel_grid(images[name]))
+                    for name in ['1', '2', '3', '4', '5', '6', '7', '8']]
+    kernels.append(('Transform.score_variants[8 targets]',
+                    lambda: Transform.score_variants(image_1_data,
+                                                     targets_data)))
+    return kernels
+
+
+def mask_kernels(label, mask_1, mask_2):
+    """Kernels that only need two masks."""
+
+    packed_1, packed_2 = PackedMask.pack(mask_1), PackedMask.pack(mask_2)
+    return [
+        ('Unchanged.match_stats%s' % label,
+         lambda: Unchanged.match_stats(mask_1, mask_2)),
+        ('Unchanged.match_stats%s[packed]' % label,
+         lambda: Unchanged.match_stats(packed_1, packed_2)),
+        ('Union.do_operator%s' % label,
+         lambda: Union.do_operator(mask_1, mask_2)),
+        ('Union.do_operator%s[packed]' % label,
+         lambda: Union.do_operator(packed_1, packed_2)),
+        ('Intersection.do_operator%s' % label,
+         lambda: Intersection.do_operator(mask_1, mask_2)),
+        ('Intersection.do_operator%s[packed]' % label,
+         lambda: Intersection.do_operator(packed_1, packed_2)),
+        ('Disjunction.do_operator%s' % label,
+         lambda: Disjunction.do_operator(mask_1, mask_2)),
+        ('Disjunction.do_operator%s[packed]' % label,
+         lambda: Disjunction.do_operator(packed_1, packed_2)),
+        ('PixelAddition.do_operator%s' % label,
+         lambda: PixelAddition.do_operator(mask_1, mask_2)),
+        ('PixelSubtraction.do_operator%s' % label,
+         lambda: PixelSubtraction.do_operator(mask_1, mask_2)),
+    ]
+
+
+def all_kernels(args):
+    images = load_figures(args.problem)
+    kernels = figure_kernels(images)
+    kernels += mask_kernels('[figure]',
+                            ImageUtils.get_image_data(images['A']),
+                            ImageUtils.get_image_data(images['B']))
+    for size in args.sizes:
+        for density in args.densities:
+            kernels += mask_kernels(
+                '[%dx%d@%.2f]' % (size, size, density),
+                synthetic_mask(size, density, 1),
+                synthetic_mask(size, density, 2))
+    return kernels
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Times the figure comparison kernels in isolation.')
+    parser.add_argument('--problem', default=DEFAULT_PROBLEM,
+                        help='problem directory to take real figures from')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[92, 184],
+                        help='edge lengths of the synthetic masks')
+    parser.add_argument('--densities', type=float, nargs='+',
+                        default=[0.05, 0.5],
+                        help='black pixel densities of the synthetic masks')
+    parser.add_argument('--filter', default='',
+                        help='only run kernels whose name contains this')
+    parser.add_argument('--min-time', type=float, default=0.05,
+                        help='minimum seconds per measurement')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='measurements per kernel; the best is reported')
+    parser.add_argument('--output', default=None,
+                        help='also write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = []
+    print '# result bytes/op: bytes of the arrays a kernel returns; ' \
+          'temporaries are not measured'
+    print '%-52s %14s %16s' % ('kernel', 'ns/op', 'result bytes/op')
+    for name, func in all_kernels(args):
+        if args.filter not in name:
+            continue
+        ns_per_op = time_per_op(func, args.min_time, args.repeat)
+        result_bytes = result_bytes_per_op(func)
+        results.append(dict(kernel=name, ns_per_op=ns_per_op,
+                            result_bytes_per_op=result_bytes))
+        print '%-52s %14.0f %16d' % (name, ns_per_op, result_bytes)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+
+from ProblemSet import ProblemSet
+from SolverService import SolverClient, SolverService
+
+DEFAULT_PORT = 7650
+
+
+def get_address(args):
+    if args.socket:
+        return args.socket
+    return args.host, args.port
+
+
+def serve(args):
+    bundle = None
+    if args.bundle:
+        from ProblemBundle import ProblemBundle
+        bundle = ProblemBundle(args.bundle)
+    service = SolverService(bundle=bundle)
+    print 'serving on %s' % (get_address(args),)
+    service.serve(get_address(args))
+
+
+def ping(args):
+    with SolverClient(get_address(args), args.timeout) as client:
+        client.ping()
+    print 'ok'
+
+
+def stats(args):
+    with SolverClient(get_address(args), args.timeout) as client:
+        print json.dumps(client.stats(), indent=2, sort_keys=True)
+
+
+def solve(args):
+    problems = args.problems
+    if args.send_figures or args.send_masks:
+        problems = [SolverClient.payload(load_problem(problem_dir),
+                                         args.send_masks)
+                    for problem_dir in problems]
+    with SolverClient(get_address(args), args.timeout) as client:
+        for result in client.solve(problems):
+            print '%s,%s,%s,%s' % (result['set'], result['problem'],
+                                   result['answer'], result['solved_by'])
+
+
+def load_problem(problem_dir):
+    problem_dir = os.path.normpath(problem_dir)
+    set_name = os.path.basename(os.path.dirname(problem_dir))
+    return ProblemSet(set_name, lazy=True).parseProblem(
+        os.path.basename(problem_dir))
+
+
+def shutdown(args):
+    with SolverClient(get_address(args), args.timeout) as client:
+        client.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Runs a resident solver service on a local socket and '
+                    'talks to it.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--socket',
+                        help='Unix domain socket to use instead of a TCP '
+                             'port')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='seconds a client waits for a response')
+    subparsers = parser.add_subparsers(dest='command')
+    serve_parser = subparsers.add_parser(
+        'serve', help='serve until a shutdown request or Ctrl-C')
+    serve_parser.add_argument('--bundle',
+                              help='ProblemBundle to serve problems and '
+                                   'masks from')
+    serve_parser.set_defaults(run=serve)
+    subparsers.add_parser('ping', help='check the service is up') \
+        .set_defaults(run=ping)
+    subparsers.add_parser('stats', help='print the service counters') \
+        .set_defaults(run=stats)
+    solve_parser = subparsers.add_parser(
+        'solve', help='solve problems and print set,problem,answer,solved_by')
+    solve_parser.add_argument('problems', nargs='+',
+                              help='problem directories, e.g. '
+                                   'Problems/Basic Problems D/Basic Problem '
+                                   'D-01')
+    solve_parser.add_argument('--send-figures', action='store_true',
+                              help='send the PNG files instead of paths')
+    solve_parser.add_argument('--send-masks', action='store_true',
+                              help='send packed masks instead of paths')
+    solve_parser.set_defaults(run=solve)
+    subparsers.add_parser('shutdown', help='stop the service gracefully') \
+        .set_defaults(run=shutdown)
+    args = parser.parse_args()
+
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,452 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import timeit
+
+import numpy as np
+from PIL import Image
+
+from Agent import Agent
+from Alignment import MAX_SHIFT, SHIFTS, aligned_pairwise_stats, figure_shape
+from ImageUtils import ImageUtils
+from MaskCache import MaskCache
+from ProblemSet import ProblemSet
+from Pruning import STAGES
+from RavensFigure import RavensFigure
+from RavensProblem import RavensProblem
+from SolverService import SolverClient, SolverService
+
+
+def figure_paths(problems_dir):
+    """Yields the path of every figure PNG under problems_dir."""
+
+    for root, _dirs, files in sorted(os.walk(problems_dir)):
+        for filename in sorted(files):
+            if filename.endswith('.png'):
+                yield os.path.join(root, filename)
+
+
+class DirectoryProblemSet(ProblemSet):
+    """A ProblemSet read from any problems directory instead of Problems/.
+
+    Only what the agent looks at is parsed: the problem type and the
+    figures, whose visualFilename points into the directory. The verbal
+    RavensObjects are left out.
+    """
+
+    # The figures ProblemSet gives 2x2 problems, and 3x3 problems in
+    # addition.
+    FIGURES_2X2 = ['A', 'B', 'C', '1', '2', '3', '4', '5', '6']
+    FIGURES_3X3 = ['D', 'E', 'F', 'G', 'H', '7', '8']
+
+    def __init__(self, problems_dir, name):
+        self.problems_dir = problems_dir
+        ProblemSet.__init__(self, name, lazy=True)
+
+    def getProblemNames(self):
+        with open(os.path.join(self.problems_dir, self.name,
+                               'ProblemList.txt')) as r:
+            return [line.rstrip() for line in r if line.rstrip()]
+
+    def parseProblem(self, problemName):
+        problem_dir = os.path.join(self.problems_dir, self.name, problemName)
+        with open(os.path.join(problem_dir, 'ProblemData.txt')) as r:
+            problem_type = r.readline().rstrip()
+            has_visual = r.readline().rstrip() == 'true'
+            has_verbal = r.readline().rstrip() == 'true'
+        problem = RavensProblem(problemName, problem_type, self.name,
+                                has_visual, has_verbal)
+        names = DirectoryProblemSet.FIGURES_2X2
+        if problem_type == '3x3':
+            names += DirectoryProblemSet.FIGURES_3X3
+        for name in names:
+            figure = RavensFigure(name, problemName, self.name)
+            figure.visualFilename = os.path.join(problem_dir, name + '.png')
+            problem.figures[name] = figure
+        return problem
+
+
+def all_problems(problems_dir):
+    """Every problem of every set under problems_dir."""
+
+    problems = []
+    for set_name in sorted(os.listdir(problems_dir)):
+        if os.path.isfile(os.path.join(problems_dir, set_name,
+                                       'ProblemList.txt')):
+            problems.extend(DirectoryProblemSet(problems_dir,
+                                                set_name).problems)
+    return problems
+
+
+def quiet_results(agent, problems):
+    """agent.solve_batch_results with the agent's progress output
+    discarded."""
+
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            return agent.solve_batch_results(problems)
+        finally:
+            sys.stdout = stdout
+
+
+def score_stats(scores):
+    """(class name, group, statistics) of every entry of a problem's
+    ClassificationEngine.scores, statistics flattened."""
+
+    for name, group_scores in scores.iteritems():
+        for score in group_scores:
+            yield name, score['group'], \
+                np.ravel([score['trans'], score['test']]).astype(np.float64)
+
+
+def verify_pruned(args):
+    """Checks that a pruning agent (coarse to fine with
+    args.coarse_to_fine) decides every problem as the full comparisons do,
+    and that every statistic it only bounded is indeed an upper bound."""
+
+    problems = all_problems(args.problems)
+    full = quiet_results(Agent(packed=args.packed), problems)
+    pruned = quiet_results(Agent(packed=args.packed, prune=True,
+                                 coarse_to_fine=args.coarse_to_fine),
+                           problems)
+
+    mismatched = []
+    compared = bounded = 0
+    by_stage = {}
+    for full_result, coarse_result in zip(full, pruned):
+        name = full_result.problem.name
+        if (full_result.answer, full_result.solved_by,
+                full_result.problem_class) != \
+                (coarse_result.answer, coarse_result.solved_by,
+                 coarse_result.problem_class):
+            mismatched.append('%s: answer %s by %s, expected %s by %s' % (
+                name, coarse_result.answer, coarse_result.solved_by,
+                full_result.answer, full_result.solved_by))
+        if full_result.classification_scores is None:
+            continue
+        for stage, count in \
+                coarse_result.comparisons_by_stage.iteritems():
+            by_stage[stage] = by_stage.get(stage, 0) + count
+        for (class_name, group, exact), (_, _, refined) in zip(
+                score_stats(full_result.classification_scores),
+                score_stats(coarse_result.classification_scores)):
+            compared += len(exact)
+            same = np.isclose(refined, exact) | \
+                (np.isnan(refined) & np.isnan(exact))
+            bounded += np.count_nonzero(~same)
+            with np.errstate(invalid='ignore'):
+                below = ~same & ~(refined >= exact)
+            if below.any():
+                mismatched.append('%s: %s %s bound below exact statistics' %
+                                  (name, class_name, ''.join(group)))
+
+    for message in mismatched:
+        print 'MISMATCH ' + message
+    print '%s: %d problems checked, %d of %d statistics bounded, ' \
+          '%d mismatched' % (args.check, len(problems), bounded, compared,
+                             len(mismatched))
+    print 'comparisons pruned: ' + ', '.join(
+        '%d at %s' % (by_stage.get(stage, 0), stage) for stage in STAGES) + \
+        ', %d compared in full' % by_stage.get('exact', 0)
+    return not mismatched
+
+
+def shifted_overlaps(masks):
+    """Reference for the FFT cross-correlation: the black pixels every pair
+    of 2D masks shares at every offset of SHIFTS, by shifting directly.
+
+    Return:
+        (numpy.ndarray): (figures x figures x len(SHIFTS)) shared pixels.
+    """
+
+    height, width = masks.shape[1:]
+    padded = np.pad(masks.astype(np.float32),
+                    ((0, 0), (MAX_SHIFT, MAX_SHIFT), (MAX_SHIFT, MAX_SHIFT)),
+                    'constant')
+    flat = masks.reshape(len(masks), -1).astype(np.float32)
+    overlaps = []
+    for dy, dx in SHIFTS:
+        shifted = padded[:, MAX_SHIFT - dy:MAX_SHIFT - dy + height,
+                         MAX_SHIFT - dx:MAX_SHIFT - dx + width]
+        overlaps.append(np.rint(np.dot(
+            flat, shifted.reshape(len(masks), -1).T)).astype(np.int64))
+    return np.stack(overlaps, axis=-1)
+
+
+def verify_align(args):
+    """Checks the FFT alignment of every pair of figures against shifting
+    directly, and reports how aligned matching changes the answers."""
+
+    problems = all_problems(args.problems)
+    agent = Agent(mask_cache=False)
+    checked, mismatched = 0, []
+    solved = [problem for problem in problems
+              if not Agent.is_skipped(problem)]
+    for problem in solved[:args.limit]:
+        figure_store = agent.create_figure_store(problem)
+        problem_figures = figure_store.get_masks()
+        figure_store.release()
+        names = sorted(problem_figures.iterkeys())
+        rows = np.stack([problem_figures[name] for name in names]) != 0
+        num_pixels = rows.shape[1]
+        counts = rows.sum(axis=1)
+        fractions, _ratios, offsets = aligned_pairwise_stats(
+            rows[np.newaxis], counts[np.newaxis], num_pixels, False)
+
+        overlaps = shifted_overlaps(
+            rows.reshape((len(names),) + figure_shape(num_pixels)))
+        best_overlaps = overlaps.max(axis=-1)
+        expected = (num_pixels - counts[:, np.newaxis] -
+                    counts[np.newaxis, :] + 2 * best_overlaps) / \
+            float(num_pixels)
+        for i in range(len(names)):
+            for j in range(i + 1, len(names)):
+                checked += 1
+                shift = np.flatnonzero(
+                    (SHIFTS == offsets[0, i, j]).all(axis=1))[0]
+                if not np.isclose(fractions[0, i, j], expected[i, j]) or \
+                        overlaps[i, j, shift] != best_overlaps[i, j]:
+                    mismatched.append('%s %s-%s' % (problem.name, names[i],
+                                                    names[j]))
+
+    unaligned = quiet_results(Agent(), problems)
+    aligned = quiet_results(Agent(align=True), problems)
+    changed = [(before, after) for before, after in zip(unaligned, aligned)
+               if before.answer != after.answer]
+
+    for message in mismatched:
+        print 'MISMATCH ' + message
+    for before, after in changed:
+        print 'CHANGED %s: answer %s by %s, was %s by %s' % (
+            before.problem.name, after.answer, after.solved_by,
+            before.answer, before.solved_by)
+    print 'align: %d pairs checked, %d mismatched; %d of %d answers ' \
+          'changed' % (checked, len(mismatched), len(changed), len(problems))
+    return not mismatched
+
+
+def verify_decode(args):
+    """Checks the vectorized decoder against the pixel-wise reference for
+    every figure in the problems directory."""
+
+    checked, mismatched = 0, []
+    for path in figure_paths(args.problems):
+        image = Image.open(path)
+        expected = ImageUtils.get_image_data_pixelwise(image)
+        actual = ImageUtils.get_image_data(image)
+        checked += 1
+        if actual.dtype != expected.dtype or \
+                not np.array_equal(actual, expected) or \
+                not np.array_equal(ImageUtils.get_image_mask(image),
+                                   expected.astype(np.bool_)):
+            mismatched.append(path)
+
+    for path in mismatched:
+        print 'MISMATCH ' + path
+    print 'decode: %d figures checked, %d mismatched' % \
+          (checked, len(mismatched))
+    return not mismatched
+
+
+def verify_mask_cache(args):
+    """Checks that MaskCache serves the decoded masks, decodes edited
+    figures again, stays under its size cap and falls back to decoding when
+    its directory is unusable."""
+
+    paths = list(figure_paths(args.problems))[:args.figures]
+    work_dir = tempfile.mkdtemp()
+    failures = []
+    try:
+        copies = []
+        for i, path in enumerate(paths):
+            copies.append(os.path.join(work_dir, '%d.png' % i))
+            shutil.copyfile(path, copies[-1])
+
+        def check(cache, path, expect_hit, label):
+            hits = cache.hits
+            mask = cache.get(path, lambda: ImageUtils.get_image_data(
+                Image.open(path)))
+            if not np.array_equal(
+                    mask, ImageUtils.get_image_data(Image.open(path))):
+                failures.append('%s: wrong mask for %s' % (label, path))
+            if (cache.hits > hits) != expect_hit:
+                failures.append('%s: expected a %s for %s' % (
+                    label, 'hit' if expect_hit else 'miss', path))
+
+        cache = MaskCache(os.path.join(work_dir, 'cache'))
+        check(cache, copies[0], False, 'first read')
+        check(cache, copies[0], True, 'second read')
+        check(MaskCache(cache.directory), copies[0], True, 'new process')
+
+        # An edited figure gets a new stamp and must be decoded again.
+        shutil.copyfile(paths[1], copies[0])
+        stat = os.stat(copies[0])
+        os.utime(copies[0], (stat.st_atime, stat.st_mtime + 10))
+        check(cache, copies[0], False, 'edited figure')
+        check(cache, copies[0], True, 'edited figure reread')
+
+        # Room for about three entries: filling it evicts the oldest ones.
+        entry_bytes = os.path.getsize(os.path.join(
+            cache.directory, os.listdir(cache.directory)[0]))
+        small = MaskCache(os.path.join(work_dir, 'small'), 3 * entry_bytes)
+        for path in copies:
+            check(small, path, False, 'filling')
+        on_disk = sum(os.path.getsize(os.path.join(small.directory, name))
+                      for name in os.listdir(small.directory))
+        if on_disk > small.max_bytes:
+            failures.append('eviction: %d bytes cached, cap %d' % (
+                on_disk, small.max_bytes))
+        check(small, copies[-1], True, 'newest entry kept')
+        check(small, copies[0], False, 'oldest entry evicted')
+
+        # A cache directory that cannot exist must not break decoding.
+        blocked = os.path.join(work_dir, 'blocked')
+        open(blocked, 'w').close()
+        for directory in (os.path.join(blocked, 'cache'), blocked):
+            check(MaskCache(directory), copies[0], False, 'unusable cache')
+
+        os.environ['RAVENS_MASK_CACHE_MAX_BYTES'] = 'lots'
+        try:
+            if MaskCache.from_environment().max_bytes != \
+                    MaskCache.DEFAULT_MAX_BYTES:
+                failures.append('malformed size cap not ignored')
+        finally:
+            del os.environ['RAVENS_MASK_CACHE_MAX_BYTES']
+    finally:
+        shutil.rmtree(work_dir)
+
+    for message in failures:
+        print 'MISMATCH ' + message
+    print 'mask-cache: %d figures checked, %d failures' % (len(paths),
+                                                          len(failures))
+    return not failures
+
+
+def verify_service(args):
+    """Starts a SolverService on a Unix domain socket and on a localhost
+    port, solves the problems over each from concurrent clients, and checks
+    the answers against solving directly, the stats and that shutdown does
+    not wait for idle clients."""
+
+    problems = [problem for problem in all_problems(args.problems)
+                if not Agent.is_skipped(problem)]
+    expected = [result.answer for result in
+                quiet_results(Agent(mask_cache=False), problems)]
+    # Payloads work for any problems directory; set and problem names only
+    # for the problems the service finds under Problems/.
+    refs = [SolverClient.payload(problem) for problem in problems]
+    if os.path.abspath(args.problems) == os.path.abspath('Problems'):
+        refs[::2] = [dict(set=problem.problemSetName, problem=problem.name)
+                     for problem in problems[::2]]
+
+    work_dir = tempfile.mkdtemp()
+    failures = []
+    stdout = sys.stdout
+    try:
+        sys.stdout = open(os.devnull, 'w')
+        for address in (os.path.join(work_dir, 'solver.sock'),
+                        ('127.0.0.1', 0)):
+            failures.extend('%s: %s' % (address, message) for message in
+                            check_service(address, refs, expected))
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        shutil.rmtree(work_dir)
+
+    for message in failures:
+        print 'MISMATCH ' + message
+    print 'service: %d problems solved over 2 sockets, %d failures' % (
+        len(problems), len(failures))
+    return not failures
+
+
+def check_service(address, refs, expected, clients=4):
+    """Serves on address and checks one SolverService. Returns the
+    failures."""
+
+    service = SolverService()
+    server = threading.Thread(target=service.serve, args=(address,))
+    server.daemon = True
+    server.start()
+    while service.server is None:
+        timeit.time.sleep(0.01)
+    address = service.address
+
+    failures = []
+    answers = [None] * len(refs)
+
+    def solve(start):
+        with SolverClient(address, timeout=60) as client:
+            for i in range(start, len(refs), clients):
+                answers[i] = client.solve([refs[i]])[0]['answer']
+
+    threads = [threading.Thread(target=solve, args=(start,))
+               for start in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for i, (answer, expected_answer) in enumerate(zip(answers, expected)):
+        if answer != expected_answer:
+            failures.append('problem %d answered %s, expected %s' % (
+                i, answer, expected_answer))
+
+    idle = SolverClient(address, timeout=60)
+    idle.ping()
+    with SolverClient(address, timeout=60) as client:
+        try:
+            client.solve([dict(set='No Such Set', problem='None')])
+            failures.append('unknown problem answered')
+        except RuntimeError:
+            pass
+        stats = client.stats()
+        if stats['problems_solved'] != len(refs) or stats['errors'] != 1 or \
+                stats['connections'] != clients + 2:
+            failures.append('unexpected stats %r' % stats)
+        client.shutdown()
+    # The idle client must not hold the service up.
+    server.join(5)
+    if server.is_alive():
+        failures.append('still serving 5 s after shutdown')
+    idle.close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Checks optimized code paths against their references.')
+    parser.add_argument('--problems', default='Problems')
+    subparsers = parser.add_subparsers(dest='check')
+    subparsers.add_parser('decode').set_defaults(run=verify_decode)
+    mask_cache = subparsers.add_parser('mask-cache')
+    mask_cache.add_argument('--figures', type=int, default=8,
+                            help='figures to cache')
+    mask_cache.set_defaults(run=verify_mask_cache)
+    subparsers.add_parser('service').set_defaults(run=verify_service)
+    align = subparsers.add_parser('align')
+    align.add_argument('--limit', type=int, default=None,
+                       help='problems whose pairs are checked by shifting '
+                            'directly (default: every solved problem)')
+    align.set_defaults(run=verify_align)
+    prune = subparsers.add_parser('prune')
+    prune.add_argument('--packed', action='store_true',
+                       help='solve on bit-packed masks')
+    prune.add_argument('--coarse-to-fine', action='store_true',
+                       help='prune on figure pyramids too')
+    prune.set_defaults(run=verify_pruned)
+    coarse_to_fine = subparsers.add_parser('coarse-to-fine')
+    coarse_to_fine.add_argument('--packed', action='store_true',
+                                help='solve on bit-packed masks')
+    coarse_to_fine.set_defaults(run=verify_pruned, coarse_to_fine=True)
+    args = parser.parse_args()
+
+    sys.exit(0 if args.run(args) else 1)
+
+
+if __name__ == '__main__':
+    main()